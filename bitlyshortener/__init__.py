@@ -1,2 +1,60 @@
-"""Package initialization."""
-from .shortener import Shortener
+"""Package initialization.
+
+The public classes are imported lazily on first access, so that importing the package is fast.
+The `config` and `exc` modules are cheap to import, and are imported eagerly.
+"""
+import importlib
+from typing import TYPE_CHECKING, Any, List
+
+from . import config, exc
+
+if TYPE_CHECKING:
+    from .asyncshortener import AsyncShortener
+    from .cache import BaseCache, Cache, CacheStats
+    from .compact import CompactCache
+    from .instrumentation import CompositeInstrumentation, Instrumentation, MetricsInstrumentation, OpenTelemetryInstrumentation, PrometheusInstrumentation
+    from .journal import Journal
+    from .normalizer import URLNormalizer
+    from .results import BatchResult, ShortenResult
+    from .service import ShortenerClient, ShortenerService
+    from .sharded import ShardedShortener
+    from .shortener import Shortener
+    from .store import BaseStore, MemoryStore, RedisStore, SQLiteStore
+
+_MODULES = {  # Module of each public class.
+    "AsyncShortener": "asyncshortener",  # Requires an optional dependency.
+    "BaseCache": "cache",
+    "BaseStore": "store",
+    "BatchResult": "results",
+    "Cache": "cache",
+    "CacheStats": "cache",
+    "CompactCache": "compact",
+    "CompositeInstrumentation": "instrumentation",
+    "Instrumentation": "instrumentation",
+    "Journal": "journal",
+    "MemoryStore": "store",
+    "MetricsInstrumentation": "instrumentation",
+    "OpenTelemetryInstrumentation": "instrumentation",
+    "PrometheusInstrumentation": "instrumentation",
+    "RedisStore": "store",
+    "SQLiteStore": "store",
+    "ShardedShortener": "sharded",
+    "ShortenResult": "results",
+    "Shortener": "shortener",
+    "ShortenerClient": "service",
+    "ShortenerService": "service",
+    "URLNormalizer": "normalizer",
+}
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_MODULES))
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _MODULES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value  # Prevents subsequent calls for the name.
+    return value
@@ -0,0 +1,223 @@
+"""Asynchronous shortener.
+
+This requires the optional `httpx` package which can be installed using `pip install bitlyshortener[async]`.
+"""
+
+# pylint: disable=duplicate-code  # The request logic mirrors that of the synchronous shortener.
+import asyncio
+import contextlib
+import logging
+import time
+from functools import _CacheInfo
+from typing import Dict, List, Optional
+
+import httpx
+
+from . import config, exc, util
+from .cache import Cache
+from .instrumentation import Instrumentation
+from .normalizer import URLNormalizer
+from .scheduler import TokenScheduler
+
+log = logging.getLogger(__name__)
+
+
+class AsyncShortener:
+    """Asynchronous shortener.
+
+    A single pooled HTTP client is used for all requests. The number of concurrent requests is bounded by a semaphore.
+    The shortener should be closed when no longer needed, such as by using it as an asynchronous context manager.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        tokens: List[str],
+        max_cache_size: int = config.DEFAULT_CACHE_SIZE,
+        max_concurrency: Optional[int] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        normalizer: Optional[URLNormalizer] = None,
+    ):
+        self._tokens = tokens
+        self._max_cache_size = max_cache_size
+        self._max_concurrency = max_concurrency or min(config.MAX_ASYNC_CONCURRENCY, len(tokens) * config.MAX_WORKERS_PER_TOKEN)
+        self._instrumentation = Instrumentation() if (instrumentation is None) else instrumentation
+        self._normalizer = URLNormalizer() if (normalizer is None) else normalizer
+        self._check_args()
+        self._tokens = sorted(self._tokens)  # Sorted for subsequent reproducible randomization.
+
+        self._cache = Cache(max_cache_size)  # Instance level cache
+        self._scheduler = TokenScheduler(self._tokens)
+        self._client: Optional[httpx.AsyncClient] = None  # Created in the running event loop.
+        self._semaphore: Optional[asyncio.Semaphore] = None  # Created in the running event loop.
+
+    async def __aenter__(self) -> "AsyncShortener":
+        return self
+
+    async def __aexit__(self, *_args: object) -> None:
+        await self.aclose()
+
+    def _check_args(self) -> None:
+        util.check_tokens(self._tokens)
+        util.check_max_cache_size(self._max_cache_size)
+        if not (isinstance(self._max_concurrency, int) and (self._max_concurrency > 0)):
+            raise exc.ArgsError(f"Max concurrency must be an integer >0, but it is {self._max_concurrency}.")
+        log.debug("Max concurrency is %s.", self._max_concurrency)
+        if not isinstance(self._instrumentation, Instrumentation):
+            raise exc.ArgsError(f"Instrumentation must be None or an instance of {Instrumentation.__qualname__}, but it is {self._instrumentation!r}.")
+        if not isinstance(self._normalizer, URLNormalizer):
+            raise exc.ArgsError(f"Normalizer must be None or an instance of {URLNormalizer.__qualname__}, but it is {self._normalizer!r}.")
+
+    def _init_client(self) -> None:
+        limits = httpx.Limits(max_connections=self._max_concurrency, max_keepalive_connections=self._max_concurrency)
+        self._client = httpx.AsyncClient(limits=limits, timeout=config.REQUEST_TIMEOUT)
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        log.debug("Initialized HTTP client with a max of %s connections.", self._max_concurrency)
+
+    async def _lengthen_url(self, short_url: str) -> str:
+        # Can raise: exc.RequestError
+        assert self._client and self._semaphore
+        short_url = short_url.strip()
+        log.debug("Requesting long URL for short URL %s.", short_url)
+        instrumentation = self._instrumentation
+        try:
+            async with self._semaphore:
+                start_time = time.monotonic()
+                with instrumentation.span("lengthen") if instrumentation.enabled else contextlib.nullcontext():
+                    response = await self._client.head(short_url, follow_redirects=False)
+                time_used = time.monotonic() - start_time
+        except httpx.TransportError as exception:
+            if instrumentation.enabled:
+                instrumentation.record_lengthen_request(None)
+            msg = f"Error receiving long URL for short URL {short_url}. The error is: {exception.__class__.__qualname__}: {exception}"
+            raise exc.RequestError(msg) from None
+        if instrumentation.enabled:
+            instrumentation.record_lengthen_request(response.status_code)
+        long_url = response.headers.get("Location")
+        if (response.status_code != 301) or (not long_url):
+            msg = f"Error receiving long URL for short URL {short_url}. The response status code is {response.status_code} instead of 301 with a location."
+            raise exc.RequestError(msg)
+        log.debug("Received long URL %s for short URL %s with status code %s in %.1fs.", long_url, short_url, response.status_code, time_used)
+        return long_url
+
+    async def _post(self, endpoint: str, token: str, long_url: str) -> httpx.Response:
+        # Can raise: httpx.TransportError
+        assert self._client and self._semaphore
+        wait = self._scheduler.reserve(token)
+        if wait > 0:
+            log.debug("Waiting %.1fs before using token starting with %s.", wait, token[:4])
+            await asyncio.sleep(wait)
+        instrumentation = self._instrumentation
+        async with self._semaphore:
+            with instrumentation.span("shorten", endpoint=endpoint, token=token[:4]) if instrumentation.enabled else contextlib.nullcontext():
+                start_time, status_code = time.monotonic(), None
+                try:
+                    response = await self._client.post(endpoint, json={"long_url": long_url}, follow_redirects=False, headers={"Authorization": f"Bearer {token}"})
+                    status_code = response.status_code
+                finally:
+                    if instrumentation.enabled:
+                        instrumentation.record_request(endpoint, token, status_code, time.monotonic() - start_time)
+        self._scheduler.record(token, response.status_code, util.parse_retry_after(response.headers.get("Retry-After")))
+        return response
+
+    async def _request_short_url(self, long_url: str) -> str:  # pylint: disable=too-many-locals
+        # Can raise: exc.RequestError
+        assert self._client and self._semaphore
+
+        # Preprocess long URL
+        if util.is_known_short_url(long_url):
+            long_url = await self._lengthen_url(long_url)
+
+        # Shorten long URL
+        attempts = util.provision_attempts(self._tokens, long_url)
+        num_max_attempts = len(attempts)
+        debug = log.isEnabledFor(logging.DEBUG)  # Descriptions are otherwise formatted only for errors.
+        instrumentation = self._instrumentation
+        num_attempt = 0
+        try:
+            for num_attempt, (endpoint, token) in enumerate(self._scheduler.schedule(attempts), start=1):
+                try:
+                    if debug:
+                        log.debug("Requesting %s.", util.response_desc(endpoint, token, long_url, num_attempt, num_max_attempts))
+                    start_time = time.monotonic()
+                    response = await self._post(endpoint, token, long_url)
+                    time_used = time.monotonic() - start_time
+                    if debug:
+                        log.debug(
+                            "Received %s having status code %s in %.1fs.",
+                            util.response_desc(endpoint, token, long_url, num_attempt, num_max_attempts),
+                            response.status_code,
+                            time_used,
+                        )
+                    response.raise_for_status()
+                    break
+                except (httpx.HTTPStatusError, httpx.TransportError) as exception:
+                    response_desc = util.response_desc(endpoint, token, long_url, num_attempt, num_max_attempts)
+                    exc_desc = f"The error is: {exception.__class__.__qualname__}: {exception}"
+                    if isinstance(exception, httpx.TransportError):
+                        log.warning("Error receiving %s. %s", response_desc, exc_desc)
+                    else:
+                        if response.status_code == 400 and util.response_message(response.content) == "ALREADY_A_BITLY_LINK":
+                            actual_long_url = await self._lengthen_url(long_url)
+                            return await self._shorten_url(actual_long_url)  # Returns normalized short URL.
+                        log.warning("Error receiving %s. The response status code is %s and text is %s. %s", response_desc, response.status_code, response.text, exc_desc)
+                        if response.status_code == 400:
+                            msg = f"The response status code is 400 and so the request will not be reattempted. {exc_desc}"
+                            raise exc.RequestError(msg) from None
+                    if num_attempt == num_max_attempts:
+                        msg = f"Exhausted all {num_max_attempts} attempts requesting response for long URL {long_url}. {exc_desc}"
+                        raise exc.RequestError(msg) from None
+        finally:
+            if instrumentation.enabled:
+                instrumentation.record_attempts(num_attempt)
+        assert response.status_code in (200, 201)
+        short_url = util.postprocess_short_url(response.json()["link"])
+        log.debug("Received short URL %s for long URL %s.", short_url, long_url)
+        return short_url
+
+    async def _shorten_url(self, long_url: str) -> str:
+        # Can raise: exc.RequestError
+        long_url = self._normalizer.normalize(long_url)
+        short_url = self._cache.get(long_url)
+        if self._instrumentation.enabled:
+            self._instrumentation.record_cache_lookup("shorten", short_url is not None)
+        if short_url is None:
+            short_url = await self._request_short_url(long_url)
+            self._cache.set(long_url, short_url)
+        return short_url
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP client."""
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+            log.debug("Closed HTTP client.")
+
+    @property
+    def cache_info(self) -> Dict[str, _CacheInfo]:
+        """Return cache info."""
+        stats = self._cache.stats()
+        return {self._shorten_url.__qualname__: _CacheInfo(stats.hits, stats.misses, stats.max_size, stats.size)}
+
+    async def shorten_urls(self, long_urls: List[str]) -> List[str]:
+        """Return a list of short URLs for the given long URLs."""
+        util.check_long_urls(long_urls)
+        if self._client is None:
+            self._init_client()
+        num_long_urls = len(long_urls)
+        normalized_long_urls = self._normalizer.normalize_batch(long_urls)
+        unique_long_urls = list(dict.fromkeys(normalized_long_urls))  # Each is shortened once.
+        log.debug("Concurrently retrieving %s short URLs for %s unique long URLs using up to %s connections.", num_long_urls, len(unique_long_urls), self._max_concurrency)
+        start_time = time.monotonic()
+        unique_short_urls = dict(zip(unique_long_urls, await asyncio.gather(*(self._shorten_url(long_url) for long_url in unique_long_urls))))
+        short_urls = [unique_short_urls[long_url] for long_url in normalized_long_urls]
+        time_used = time.monotonic() - start_time
+        rate_per_second = (num_long_urls / time_used) if (time_used != 0) else float("inf")
+        log.info("Concurrently retrieved %s short URLs in %.1fs at a rate of %s/s.", num_long_urls, time_used, f"{rate_per_second:,.0f}")
+        return short_urls
+
+    async def shorten_urls_to_dict(self, long_urls: List[str]) -> Dict[str, str]:
+        """Return a mapping of short URLs for the given long URLs."""
+        util.check_long_urls(long_urls)
+        short_urls = await self.shorten_urls(long_urls)
+        return dict(zip(long_urls, short_urls))
@@ -0,0 +1,223 @@
+"""Memory caches."""
+import dataclasses
+import json
+import logging
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+import cachetools
+
+from . import config, exc
+
+log = logging.getLogger(__name__)
+
+POLICIES = {"lfu": cachetools.LFUCache, "lru": cachetools.LRUCache, "ttl": cachetools.TTLCache}
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheStats:
+    """Statistics of a cache."""
+
+    hits: int
+    misses: int
+    evictions: int  # Includes expired entries which were removed.
+    size: int
+    max_size: int
+    bytes: Optional[int]  # Approximate. It is None if the cache is not bounded in bytes.
+    max_bytes: Optional[int]
+
+    @property
+    def hit_rate(self) -> float:
+        """Return the fraction of lookups which were hits."""
+        lookups = self.hits + self.misses
+        return (self.hits / lookups) if lookups else 0.0
+
+
+class BaseCache:
+    """Base class of thread-safe memory caches.
+
+    :param max_size: max number of entries.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        if not (isinstance(max_size, int) and (max_size >= 0)):
+            raise exc.ArgsError(f"Max cache size must be an integer ≥0, but it is {max_size}.")
+        self._lock = threading.Lock()
+        self._hits, self._misses, self._evictions = 0, 0, 0
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _get(self, key: Hashable) -> Any:  # Lock must be held.
+        raise NotImplementedError
+
+    def _items(self) -> List[Tuple[Any, Any]]:  # Lock must be held.
+        raise NotImplementedError
+
+    def _set(self, key: Hashable, value: Any) -> None:  # Lock must be held.
+        raise NotImplementedError
+
+    def _size_in_bytes(self) -> Tuple[Optional[int], Optional[int]]:  # Lock must be held.
+        return None, None
+
+    def export_file(self, path: Union[str, Path]) -> None:
+        """Write the entries to the given file as JSON lines, in insertion order."""
+        items = self.items()
+        with Path(path).open("w") as file:
+            for item in items:
+                file.write(json.dumps(item) + "\n")
+        log.info("Exported %s cache entries to %s.", len(items), path)
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value for the given key, or None if it is not cached."""
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return value
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Any, Any]:
+        """Return the cached values for those of the given keys which are cached, acquiring the lock once for all of them."""
+        values = {}
+        with self._lock:
+            for key in keys:
+                value = self._get(key)
+                if value is None:
+                    self._misses += 1
+                else:
+                    self._hits += 1
+                    values[key] = value
+        return values
+
+    def import_file(self, path: Union[str, Path]) -> None:
+        """Set the entries from the given file as written by `export_file`."""
+        with Path(path).open() as file:
+            num_items = self.warm(json.loads(line) for line in file)
+        log.info("Imported %s cache entries from %s.", num_items, path)
+
+    def items(self) -> List[Tuple[Any, Any]]:
+        """Return a list of the (key, value) entries in insertion order."""
+        with self._lock:
+            return self._items()
+
+    def peek(self, key: Hashable) -> Any:
+        """Return the cached value for the given key, or None if it is not cached, without affecting the hit and miss statistics."""
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Set the cached value for the given key. The value must not be None."""
+        if self._max_size:
+            with self._lock:
+                self._set(key, value)
+
+    def stats(self) -> CacheStats:
+        """Return cache statistics."""
+        with self._lock:
+            size_in_bytes, max_size_in_bytes = self._size_in_bytes()
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                size=len(self),
+                max_size=self._max_size,
+                bytes=size_in_bytes,
+                max_bytes=max_size_in_bytes,
+            )
+
+    def warm(self, items: Iterable[Tuple[Any, Any]]) -> int:
+        """Set the given (key, value) entries without affecting the hit and miss statistics, and return their number."""
+        num_items = 0
+        with self._lock:
+            for key, value in items:
+                if self._max_size:
+                    self._set(key, value)
+                num_items += 1
+        return num_items
+
+
+class Cache(BaseCache):
+    """Thread-safe memory cache.
+
+    :param max_size: max number of entries.
+    :param policy: eviction policy, which is one of "lru", "lfu" and "ttl". The "ttl" policy additionally evicts LRU entries.
+    :param ttl: seconds after which an entry expires. It is required for and only valid for the "ttl" policy.
+    :param max_bytes: approximate max number of bytes of the entries, if any.
+    """
+
+    def __init__(self, max_size: int, *, policy: str = "lru", ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        super().__init__(max_size)
+        self._policy = policy
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._check_args()
+
+        kwargs: Dict[str, Any] = {"maxsize": max_size}
+        if max_bytes is not None:
+            kwargs.update(maxsize=max_bytes, getsizeof=self._sizeof)
+        if policy == "ttl":
+            kwargs["ttl"] = ttl
+        self._cache: cachetools.Cache = POLICIES[policy](**kwargs)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(max_size={self._max_size}, policy={self._policy!r}, ttl={self._ttl}, max_bytes={self._max_bytes})"
+
+    @staticmethod
+    def _sizeof(value: Any) -> int:  # Key size is added by _set.
+        return sys.getsizeof(value) + config.CACHE_ENTRY_OVERHEAD
+
+    def _check_args(self) -> None:
+        if self._policy not in POLICIES:
+            raise exc.ArgsError(f"Cache policy must be one of {sorted(POLICIES)}, but it is {self._policy!r}.")
+        if (self._policy == "ttl") != (self._ttl is not None):
+            raise exc.ArgsError(f"Cache TTL must be specified if and only if the cache policy is ttl, but it is {self._ttl} for the {self._policy} policy.")
+        if (self._ttl is not None) and not (isinstance(self._ttl, (int, float)) and (self._ttl > 0)):
+            raise exc.ArgsError(f"Cache TTL must be a number >0, but it is {self._ttl}.")
+        if (self._max_bytes is not None) and not (isinstance(self._max_bytes, int) and (self._max_bytes > 0)):
+            raise exc.ArgsError(f"Max cache bytes must be None or an integer >0, but it is {self._max_bytes}.")
+
+    def _get(self, key: Hashable) -> Any:
+        value = self._cache.get(key)
+        return value.value if isinstance(value, _SizedValue) else value
+
+    def _items(self) -> List[Tuple[Any, Any]]:
+        return [(key, value.value if isinstance(value, _SizedValue) else value) for key, value in self._cache.items()]
+
+    def _set(self, key: Hashable, value: Any) -> None:
+        cache = self._cache
+        if self._max_bytes is not None:
+            value = _SizedValue(value, sys.getsizeof(key))
+        num_entries = len(cache) + (key not in cache)
+        while num_entries > self._max_size:  # Applicable if bounded in bytes, in which case the size of the cache isn't its number of entries.
+            cache.popitem()
+            num_entries -= 1
+            self._evictions += 1
+        try:
+            cache[key] = value
+        except ValueError:  # Value is too large.
+            return
+        self._evictions += num_entries - len(cache)
+
+    def _size_in_bytes(self) -> Tuple[Optional[int], Optional[int]]:
+        return (None, None) if (self._max_bytes is None) else (int(self._cache.currsize), self._max_bytes)
+
+
+class _SizedValue:
+    """Cached value with the size of its key for the purpose of measuring the size of the entry."""
+
+    __slots__ = ("value", "key_size")
+
+    def __init__(self, value: Any, key_size: int):
+        self.value = value
+        self.key_size = key_size
+
+    def __sizeof__(self) -> int:
+        return sys.getsizeof(self.value) + self.key_size
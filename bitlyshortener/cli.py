@@ -0,0 +1,149 @@
+"""Command-line interface for shortening long URLs in bulk."""
+import argparse
+import contextlib
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from . import config, exc
+from .cache import Cache
+from .journal import Journal
+from .shortener import Shortener
+
+log = logging.getLogger(__name__)
+
+FORMATS = ("text", "csv", "jsonl")
+
+_SUFFIX_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}  # Other suffixes are of the text format.
+
+Writer = Callable[[str, Optional[str], Optional[exc.RequestError]], None]
+
+
+def _format(path: Optional[str], output_format: Optional[str]) -> str:
+    if output_format is not None:
+        return output_format
+    return "text" if (path in (None, "-")) else _SUFFIX_FORMATS.get(Path(str(path)).suffix.lower(), "text")
+
+
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=config.PACKAGE_NAME,
+        description="Shorten long URLs in bulk, streaming them from files or from stdin, and writing each result as soon as it is in order.",
+        epilog="The exit status is 1 if any long URL could not be shortened.",
+    )
+    parser.add_argument("inputs", nargs="*", default=["-"], help="input files of long URLs, with - being stdin, which is also the default")
+    parser.add_argument("-f", "--input-format", choices=FORMATS, help="format of the input files, which is otherwise inferred from their suffix")
+    parser.add_argument("--column", default="0", help="CSV column of the long URLs as a zero-based index, or as a name if the first row is a header (default: 0)")
+    parser.add_argument("--key", default="long_url", help="JSONL key of the long URLs if the lines are objects rather than strings (default: long_url)")
+    parser.add_argument("-o", "--output", default="-", help="output file, with - being stdout, which is also the default")
+    parser.add_argument("-F", "--output-format", choices=FORMATS, help="format of the output, which is otherwise inferred from its suffix")
+    parser.add_argument("-t", "--tokens", default=os.environ.get("BITLY_TOKENS"), help="comma-separated tokens (default: BITLY_TOKENS environment variable)")
+    parser.add_argument("-w", "--max-workers", type=int, default=config.MAX_WORKERS, help=f"max number of concurrent requests (default: {config.MAX_WORKERS})")
+    parser.add_argument("--max-pending", type=int, help="max number of long URLs which are being shortened at a time (default: twice the number of workers)")
+    parser.add_argument("--cache-file", help="file from which the cache is imported if it exists, and to which it is exported at the end")
+    parser.add_argument("--cache-size", type=int, default=config.CLI_CACHE_SIZE, help=f"max number of entries of the memory-cache (default: {config.CLI_CACHE_SIZE})")
+    parser.add_argument("--journal", help="journal file with which an interrupted run can be resumed without requesting the already shortened long URLs")
+    parser.add_argument(
+        "--progress-interval", type=float, default=config.CLI_PROGRESS_INTERVAL, help=f"seconds between progress reports, or 0 for none (default: {config.CLI_PROGRESS_INTERVAL})"
+    )
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="log info messages, or debug messages if repeated")
+    args = parser.parse_intermixed_args(argv)
+    if not args.tokens:
+        parser.error("tokens must be specified by --tokens or by the BITLY_TOKENS environment variable")
+    if args.max_workers < 1:
+        parser.error("--max-workers must be at least 1")
+    return args
+
+
+def _read_long_urls(paths: List[str], input_format: Optional[str], column: str, key: str) -> Iterator[str]:
+    for path in paths:
+        file_format = _format(path, input_format)
+        with contextlib.nullcontext(sys.stdin) if (path == "-") else open(path, encoding="utf-8", newline="") as file:
+            if file_format == "csv":
+                rows = csv.reader(file)
+                index = int(column) if column.isdigit() else next(rows, []).index(column)  # A missing column raises ValueError.
+                yield from (row[index] for row in rows if row)
+            elif file_format == "jsonl":
+                values = (json.loads(line) for line in file if line.strip())
+                yield from (value if isinstance(value, str) else value[key] for value in values)
+            else:
+                yield from (line.strip() for line in file if line.strip())
+
+
+def _report_progress(num_results: int, num_errors: int, time_used: float) -> None:
+    rate_per_second = (num_results / time_used) if (time_used != 0) else float("inf")
+    print(f"Shortened {num_results:,} long URLs with {num_errors:,} errors in {time_used:.1f}s at a rate of {rate_per_second:,.0f}/s.", file=sys.stderr, flush=True)
+
+
+def _writer(file: TextIO, output_format: str) -> Writer:
+    if output_format == "csv":
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(["long_url", "short_url", "error"])
+
+        def write(long_url: str, short_url: Optional[str], error: Optional[exc.RequestError]) -> None:
+            csv_writer.writerow([long_url, short_url or "", "" if (error is None) else str(error)])
+
+    elif output_format == "jsonl":
+
+        def write(long_url: str, short_url: Optional[str], error: Optional[exc.RequestError]) -> None:
+            file.write(json.dumps({"long_url": long_url, "short_url": short_url, "error": None if (error is None) else str(error)}) + "\n")
+
+    else:
+
+        def write(long_url: str, short_url: Optional[str], error: Optional[exc.RequestError]) -> None:  # pylint: disable=unused-argument  # Errors are logged.
+            if short_url is not None:
+                file.write(f"{long_url}\t{short_url}\n")
+
+    return write
+
+
+def _write_results(results: Iterable[Tuple[str, Union[str, exc.RequestError]]], file: TextIO, output_format: str, progress_interval: float) -> int:
+    # Returns the number of errors.
+    write = _writer(file, output_format)
+    num_results, num_errors, start_time = 0, 0, time.monotonic()
+    reported_time = start_time
+    try:
+        for long_url, result in results:
+            if isinstance(result, exc.RequestError):
+                write(long_url, None, result)
+                num_errors += 1
+            else:
+                write(long_url, result, None)
+            num_results += 1
+            now = time.monotonic()
+            if progress_interval and ((now - reported_time) >= progress_interval):
+                file.flush()  # Makes results available incrementally.
+                _report_progress(num_results, num_errors, now - start_time)
+                reported_time = now
+    finally:
+        file.flush()
+    if progress_interval:
+        _report_progress(num_results, num_errors, time.monotonic() - start_time)
+    return num_errors
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Shorten long URLs as per the given command-line arguments, and return the exit status."""
+    args = _parse_args(argv)
+    logging.basicConfig(level={0: logging.WARNING, 1: logging.INFO}.get(args.verbose, logging.DEBUG), format="%(asctime)s %(name)s:%(levelname)s: %(message)s")
+    config.MAX_WORKERS = args.max_workers
+    cache = Cache(args.cache_size)
+    if args.cache_file and Path(args.cache_file).exists():
+        cache.import_file(args.cache_file)
+    shortener = Shortener(tokens=args.tokens.split(","), cache=cache)
+    long_urls = _read_long_urls(args.inputs, args.input_format, args.column, args.key)
+    with contextlib.ExitStack() as stack:
+        output_file: TextIO = sys.stdout if (args.output == "-") else stack.enter_context(open(args.output, "w", encoding="utf-8", newline=""))
+        journal = stack.enter_context(Journal(args.journal)) if args.journal else None
+        results = shortener.shorten_urls_job(long_urls, journal, max_pending=args.max_pending) if journal else shortener.shorten_urls_iter(long_urls, max_pending=args.max_pending)
+        try:
+            num_errors = _write_results(results, output_file, _format(args.output, args.output_format), args.progress_interval)
+        finally:
+            if args.cache_file:
+                cache.export_file(args.cache_file)
+    return 1 if num_errors else 0
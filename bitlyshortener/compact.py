@@ -0,0 +1,212 @@
+"""Compact memory cache of long URL to short URL mappings."""
+import hashlib
+import json
+import logging
+import string
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from . import config, exc
+from .cache import BaseCache
+
+log = logging.getLogger(__name__)
+
+
+class BytesIntEncoder:  # Ref: https://stackoverflow.com/a/54500910/
+    """Encode bytes as an integer and back."""
+
+    def __init__(self, chars: bytes = (string.ascii_letters + string.digits).encode()):
+        num_chars = len(chars)
+        translation = "".join(chr(i) for i in range(1, num_chars + 1)).encode()
+        self._translation_table = bytes.maketrans(chars, translation)
+        self._reverse_translation_table = bytes.maketrans(translation, chars)
+        self._num_bits_per_char = (num_chars + 1).bit_length()
+
+    def encode(self, chars: bytes) -> int:
+        """Return an integer representation of the given bytes."""
+        num_bits_per_char = self._num_bits_per_char
+        output, bit_idx = 0, 0
+        for chr_idx in chars.translate(self._translation_table):
+            output |= chr_idx << bit_idx
+            bit_idx += num_bits_per_char
+        return output
+
+    def decode(self, i: int) -> bytes:  # pylint: disable=invalid-name
+        """Return the original bytes representation of the given integer."""
+        maxint = (2**self._num_bits_per_char) - 1
+        output = bytes(((i >> offset) & maxint) for offset in range(0, i.bit_length(), self._num_bits_per_char))
+        return output.translate(self._reverse_translation_table)
+
+
+class ShortURLCodec:
+    """Encode a short URL as an integer and back.
+
+    The prefix of the short URL up to and including the slash after its domain is interned, and the hash after it is
+    packed into the integer along with the index of the interned prefix. A short URL which can't be encoded is returned
+    unchanged.
+    """
+
+    _CHARS = (string.ascii_letters + string.digits + "-_").encode()
+
+    def __init__(self) -> None:
+        self._encoder = BytesIntEncoder(self._CHARS)
+        self._prefixes: List[str] = []
+        self._prefix_indexes: Dict[str, int] = {}
+        self._max_num_prefixes = 2**config.COMPACT_CACHE_PREFIX_BITS
+
+    def decode(self, value: Any) -> str:
+        """Return the short URL for the given encoded value."""
+        if isinstance(value, str):
+            return value
+        prefix = self._prefixes[value & (self._max_num_prefixes - 1)]
+        return prefix + self._encoder.decode(value >> config.COMPACT_CACHE_PREFIX_BITS).decode()
+
+    def encode(self, short_url: str) -> Any:
+        """Return the encoded value of the given short URL. It is an integer unless the short URL can't be encoded."""
+        prefix, _, hash_ = short_url.rpartition("/")
+        prefix += "/"
+        if not (prefix.startswith("https://") and (prefix.count("/") == 3) and hash_.isascii() and hash_ and (hash_.encode().strip(self._CHARS) == b"")):
+            return short_url
+        prefix_index = self._prefix_indexes.get(prefix)
+        if prefix_index is None:  # Not thread-safe, and so the lock of the cache must be held.
+            if len(self._prefixes) == self._max_num_prefixes:
+                return short_url
+            prefix_index = self._prefix_indexes[prefix] = len(self._prefixes)
+            self._prefixes.append(prefix)
+        return (self._encoder.encode(hash_.encode()) << config.COMPACT_CACHE_PREFIX_BITS) | prefix_index
+
+
+class CompactCache(BaseCache):
+    """Thread-safe memory cache of long URL to short URL mappings which uses a fraction of the memory of `Cache`.
+
+    Short URLs are stored as packed integers. Long URLs are optionally stored as fixed-size digests instead of as strings.
+    The eviction policy approximates LRU by using two generations of entries, each with up to half of the max number of
+    entries. When the young generation is full, the old generation is evicted, and the young one becomes old. An entry
+    which is accessed in the old generation is moved to the young one. This avoids the memory overhead of a linked list.
+
+    :param max_size: max number of entries.
+    :param digest_size: if specified, each long URL is stored as a BLAKE2b digest of this number of bytes.
+    :param verify: if true, a CRC-32 checksum of each long URL is also stored and verified so as to detect the collision
+        of two long URLs having the same digest. It requires `digest_size`.
+
+    With `digest_size`, the long URLs of the entries exported by `export_file` are hex digests. They can be imported by
+    `import_file` or set by `warm` using `digested=True` into a cache having the same digest size and without `verify`.
+    """
+
+    def __init__(self, max_size: int, *, digest_size: Optional[int] = None, verify: bool = False):
+        super().__init__(max_size)
+        self._digest_size = digest_size
+        self._verify = verify
+        self._check_args()
+        self._codec = ShortURLCodec()
+        self._young: Dict[Any, Any] = {}
+        self._old: Dict[Any, Any] = {}
+        self._max_generation_size = max(1, max_size // 2)
+
+    def __len__(self) -> int:
+        return len(self._young) + len(self._old)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(max_size={self._max_size}, digest_size={self._digest_size}, verify={self._verify})"
+
+    def _check_args(self) -> None:
+        digest_size = self._digest_size
+        min_digest_size, max_digest_size = config.MIN_COMPACT_CACHE_DIGEST_SIZE, hashlib.blake2b.MAX_DIGEST_SIZE  # pylint: disable=no-member
+        if (digest_size is not None) and not (isinstance(digest_size, int) and (min_digest_size <= digest_size <= max_digest_size)):
+            raise exc.ArgsError(f"Digest size must be None or an integer from {min_digest_size} to {max_digest_size}, but it is {digest_size}.")
+        if self._verify and (digest_size is None):
+            raise exc.ArgsError("Verification requires a digest size.")
+
+    def _encode_key(self, long_url: str) -> Tuple[Any, Optional[int]]:
+        if self._digest_size is None:
+            return long_url, None
+        long_url_bytes = long_url.encode()
+        key = hashlib.blake2b(long_url_bytes, digest_size=self._digest_size).digest()
+        return key, (zlib.crc32(long_url_bytes) if self._verify else None)
+
+    def _get(self, key: Hashable) -> Any:
+        assert isinstance(key, str)
+        encoded_key, checksum = self._encode_key(key)
+        value = self._young.get(encoded_key)
+        if value is None:
+            value = self._old.pop(encoded_key, None)
+            if value is None:
+                return None
+            self._set_encoded(encoded_key, value)
+        if self._verify:
+            value_checksum, value = self._unpack(value)
+            if value_checksum != checksum:
+                log.warning("Ignoring cached short URL for long URL %s as its digest collides with that of another long URL.", key)
+                return None
+        return self._codec.decode(value)
+
+    def _items(self) -> List[Tuple[Any, Any]]:
+        items = []
+        for generation in (self._old, self._young):
+            for encoded_key, value in generation.items():
+                key = encoded_key.hex() if isinstance(encoded_key, bytes) else encoded_key  # Is JSON serializable.
+                items.append((key, self._codec.decode(self._unpack(value)[1] if self._verify else value)))
+        return items
+
+    @staticmethod
+    def _pack(checksum: int, encoded_value: Any) -> Any:
+        return (encoded_value << 32) | checksum if isinstance(encoded_value, int) else (checksum, encoded_value)
+
+    def _set(self, key: Hashable, value: Any) -> None:
+        assert isinstance(key, str) and isinstance(value, str)
+        encoded_key, checksum = self._encode_key(key)
+        encoded_value = self._codec.encode(value)
+        self._old.pop(encoded_key, None)
+        self._set_encoded(encoded_key, encoded_value if (checksum is None) else self._pack(checksum, encoded_value))
+
+    def _set_digested(self, key: str, value: str) -> None:
+        try:
+            encoded_key = bytes.fromhex(key)
+        except ValueError:
+            encoded_key = b""
+        if len(encoded_key) != self._digest_size:
+            raise exc.ArgsError(f"Digest of a long URL must be a hex string of {self._digest_size} bytes, but it is {key!r}.")
+        self._old.pop(encoded_key, None)
+        self._set_encoded(encoded_key, self._codec.encode(value))
+
+    @staticmethod
+    def _unpack(value: Any) -> Tuple[int, Any]:
+        return (value & 0xFFFFFFFF, value >> 32) if isinstance(value, int) else value
+
+    def _set_encoded(self, encoded_key: Any, encoded_value: Any) -> None:
+        young = self._young
+        if (encoded_key not in young) and (len(young) >= self._max_generation_size):
+            self._evictions += len(self._old)
+            self._old, self._young = young, {}
+            young = self._young
+        young[encoded_key] = encoded_value
+
+    def import_file(self, path: Union[str, Path], *, digested: bool = False) -> None:
+        """Set the entries from the given file as written by `export_file`.
+
+        :param digested: whether the long URLs of the entries are hex digests, as per `warm`.
+        """
+        with Path(path).open() as file:
+            num_items = self.warm((json.loads(line) for line in file), digested=digested)
+        log.info("Imported %s cache entries from %s.", num_items, path)
+
+    def warm(self, items: Iterable[Tuple[Any, Any]], *, digested: bool = False) -> int:
+        """Set the given (key, value) entries without affecting the hit and miss statistics, and return their number.
+
+        :param digested: whether the long URLs of the entries are hex digests as exported from a cache having the same digest size. It requires `digest_size`,
+            and is not supported with `verify` as the long URLs can't be verified.
+        """
+        if not digested:
+            return super().warm(items)
+        if self._digest_size is None:
+            raise exc.ArgsError("Digested entries require a digest size.")
+        if self._verify:
+            raise exc.ArgsError("Digested entries can't be set with verification as their long URLs can't be verified.")
+        num_items = 0
+        with self._lock:
+            for key, value in items:
+                if self._max_size:
+                    self._set_digested(key, value)
+                num_items += 1
+        return num_items
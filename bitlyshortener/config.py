@@ -1,10 +1,11 @@
 """Package configuration."""
-import logging.config
 from pathlib import Path
 
 
 def configure_logging() -> None:
     """Configure logging."""
+    import logging.config  # pylint: disable=import-outside-toplevel  # Imported lazily as it is slow to import.
+
     logging.config.dictConfig(LOGGING)
     log = logging.getLogger(__name__)
     log.debug("Logging is configured.")
@@ -15,14 +16,59 @@ API_URL_BITLINKS = f"{API_BASE_URL}/bitlinks"  # Ref: https://dev.bitly.com/api-
 API_URL_ORGANIZATIONS = f"{API_BASE_URL}/organizations"  # Ref: https://dev.bitly.com/api-reference#getOrganizations
 API_URL_FORMAT_ORGANIZATION_LIMITS = f"{API_BASE_URL}/organizations/{{organization_guid}}/plan_limits"  # Ref: https://dev.bitly.com/api-reference#getPlanLimits
 API_URL_SHORTEN = f"{API_BASE_URL}/shorten"  # Ref: https://dev.bitly.com/api-reference#createBitlink
+BREAKER_BACKOFF = 1  # Initial seconds for which a circuit breaker is open.
+BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failed requests after which a circuit breaker opens.
+BREAKER_POLL_INTERVAL = 0.1  # Seconds between checks of circuit breakers while waiting for one to allow a request.
+CACHE_ENTRY_OVERHEAD = 100  # Approximate bytes used by a cache entry in addition to its key and value.
+CLI_CACHE_SIZE = 2**16  # Default max number of entries of the memory-cache of the command-line interface.
+CLI_PROGRESS_INTERVAL = 5  # Default seconds between progress reports of the command-line interface.
+COMPACT_CACHE_PREFIX_BITS = 16  # Max number of distinct short URL prefixes is 2**16.
 DEFAULT_CACHE_SIZE = 256
+DEFAULT_SHORT_URL_NORMALIZATION_STEPS = ("strip", "lowercase_host", "remove_default_port")  # The path of a short URL is case-sensitive.
+DEFAULT_URL_NORMALIZATION_STEPS = ("strip", "lowercase_host", "remove_default_port", "add_root_path")  # See URLNormalizer.
+ENDPOINT_EXPLORATION_RATE = 0.05  # Fraction of requests made first to the slower endpoint so that its latency remains known.
+ENDPOINT_ORDER_INTERVAL = 1  # Min seconds between recomputations of the order of the endpoints by their latency.
+HEDGE_DUPLICATE_BUDGET = 100  # Max number of duplicate short URLs which hedged requests of a shortener can create under other tokens.
+HEDGE_PERCENTILE = 95  # Percentile of recent latencies of an endpoint after which a request to it is hedged.
+JOURNAL_FSYNC_ENTRIES = 1000  # Max number of journal entries pending fsync.
+JOURNAL_FSYNC_INTERVAL = 1  # Max seconds for which a journal entry is pending fsync.
 KNOWN_SHORT_DOMAINS = {"bit.ly", "j.mp"}
+LATENCY_WINDOW = 256  # Number of recent latencies tracked per endpoint.
+MAX_ASYNC_CONCURRENCY = 100
+MAX_BREAKER_BACKOFF = 60  # Seconds.
+MAX_BREAKER_WAIT = 0  # Max seconds for which a request waits for a circuit breaker to allow a request instead of failing fast.
+MAX_HEDGE_FRACTION = 0.05  # Max fraction of requests which are hedged.
+MAX_PENDING_PER_WORKER = 2
+MAX_TOKEN_COOLDOWN = 300
 MAX_WORKERS = 32
 MAX_WORKERS_PER_TOKEN = 5  # Ref: https://dev.bitly.com/v4/#section/Rate-Limiting
+MIN_COMPACT_CACHE_DIGEST_SIZE = 8  # Bytes.
+MIN_CONCURRENCY_DECREASE_INTERVAL = 1  # Seconds.
+MIN_HEDGE_DELAY = 0.05  # Seconds.
+MIN_LATENCY_SAMPLES = 20  # Number of latencies of an endpoint which are required for it to be considered.
+NEGATIVE_CACHE_SIZE = 1024
+NEGATIVE_CACHE_TTL = 3600  # Seconds.
 PACKAGE_NAME = Path(__file__).parent.stem
+QUOTA_REFRESH_RETRY_TIME = 60  # Seconds after which a failed background refresh of usage is retried.
+QUOTA_RESERVE = 0.01  # Fraction of the monthly quota of a token below which the token is avoided.
 REQUEST_TIMEOUT = 3
+SERVICE_BATCH_WINDOW = 0.005  # Seconds for which the requests of clients of the service are collected into a batch.
+SERVICE_CLIENT_TIMEOUT = 60  # Seconds for which a client waits for a response from the service.
+SERVICE_MAX_BATCH_SIZE = 1000  # Max number of long URLs of a batch of the service, which can be exceeded by a single request.
+SERVICE_MAX_CONCURRENT_BATCHES = 4
+SERVICE_PORT = 8337
+STORE_LOCK_POLL_INTERVAL = 0.05  # Seconds between checks of a store by a shortener waiting for another one to store a short URL.
+STORE_LOCK_TTL = 30  # Seconds after which the lock of a long URL in a single-flight store expires if it is not released.
+STORE_MAX_BATCH_SIZE = 500  # Max number of long URLs per read or write of a store.
+STORE_MMAP_SIZE = 2**28  # Bytes of the store database file to memory-map.
+STORE_REDIS_KEY_PREFIX = f"{PACKAGE_NAME}:"
+STORE_TIMEOUT = 10  # Seconds to wait for a lock on the store database file, or for a reply from a store server.
 TEST_API_ON_INIT = False
 TEST_LONG_URL = "https://python.org/"
+TOKEN_BURST_LIMIT = 100  # Requests per token that can be made at once. See README.md for rate limits.
+TOKEN_ERROR_COOLDOWN = 1  # Initial seconds for which a token is throttled after a server error.
+TOKEN_RATE_LIMIT = 100 / 60  # Sustained requests per second per token. See README.md for rate limits.
+TOKEN_RATE_LIMITED_COOLDOWN = 10  # Initial seconds for which a token is throttled after a rate limit error.
 USAGE_CACHE_TIME = 3600
 
 LOGGING = {  # Ref: https://docs.python.org/3/howto/logging.html#configuring-logging
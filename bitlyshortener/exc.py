@@ -24,3 +24,11 @@ class ArgsError(ShortenerError):
 
 class RequestError(ShortenerError):
     """Exception for upstream request errors."""
+
+
+class StoreError(ShortenerError):
+    """Exception for errors reported by a store."""
+
+
+class CircuitOpenError(RequestError):
+    """Exception for upstream requests which are not made as circuit breakers are open."""
@@ -0,0 +1,247 @@
+"""Local stand-in for the Bitly API for use in testing and benchmarking without tokens or network access."""
+import collections
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Counter, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+_PATCHED_CONFIG_NAMES = ("API_URL_BITLINKS", "API_URL_FORMAT_ORGANIZATION_LIMITS", "API_URL_ORGANIZATIONS", "API_URL_SHORTEN", "KNOWN_SHORT_DOMAINS")
+
+
+class FakeBitlyServer:
+    """Local stand-in for the Bitly API.
+
+    It serves the /v4/shorten, /v4/bitlinks, /v4/organizations and /v4/organizations/{guid}/plan_limits endpoints, and
+    the 301 redirect of its own short URLs. Each token is treated as a separate account. A long URL which is a short URL
+    of the server receives the ALREADY_A_BITLY_LINK error. As the server doesn't use TLS, its short URLs must be given
+    to it with the http scheme, although the shortener returns them with the https scheme.
+
+    When used as a context manager, the server is started and `config` is patched to use it.
+
+    :param latency: seconds added to each response.
+    :param latency_jitter: max seconds randomly added to the latency.
+    :param rate_limit_error_rate: fraction of shortening requests which randomly receive a status code of 429.
+    :param server_error_rate: fraction of shortening requests which randomly receive a status code of 503.
+    :param encodes_limit: monthly limit of encodes per token as reported by the plan_limits endpoint.
+    :param seed: seed for the randomization of latency and errors.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        rate_limit_error_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        encodes_limit: int = 1000,
+        seed: Optional[int] = 0,
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit_error_rate = rate_limit_error_rate
+        self.server_error_rate = server_error_rate
+        self.encodes_limit = encodes_limit
+        self.requests: Counter[str] = collections.Counter()  # Keyed by endpoint, e.g. "/v4/shorten" or "HEAD".
+        self._randomizer = random.Random(seed)
+        self._links: Dict[Tuple[str, str], str] = {}  # (token, long URL) -> hash
+        self._long_urls: Dict[str, str] = {}  # hash -> long URL
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), _RequestHandler)
+        self._server.fake = self
+        self._thread: Optional[threading.Thread] = None
+        self._original_config: Dict[str, Any] = {}
+
+    def __enter__(self) -> "FakeBitlyServer":
+        self.start()
+        self.patch_config()
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.restore_config()
+        self.stop()
+
+    @property
+    def netloc(self) -> str:
+        """Return the host and port of the server."""
+        return f"127.0.0.1:{self._server.server_port}"
+
+    @property
+    def num_links(self) -> int:
+        """Return the number of links created across all tokens."""
+        return len(self._links)
+
+    def _error(self) -> Optional[int]:
+        with self._lock:
+            value = self._randomizer.random()
+        if value < self.rate_limit_error_rate:
+            return 429
+        if value < (self.rate_limit_error_rate + self.server_error_rate):
+            return 503
+        return None
+
+    def count_request(self, key: str) -> None:
+        """Count a request for the given key of `requests`, such as an endpoint."""
+        with self._lock:
+            self.requests[key] += 1
+
+    def delay(self) -> None:
+        """Sleep for the configured latency."""
+        latency = self.latency
+        if self.latency_jitter:
+            with self._lock:
+                latency += self._randomizer.uniform(0, self.latency_jitter)
+        if latency:
+            time.sleep(latency)
+
+    def long_url(self, hash_: str) -> Optional[str]:
+        """Return the long URL of the given hash of a short URL, if it exists."""
+        return self._long_urls.get(hash_)
+
+    def organization_guid(self, token: str) -> str:
+        """Return the organization GUID of the given token."""
+        return "o_" + hashlib.sha256(token.encode()).hexdigest()[:10]
+
+    def patch_config(self) -> None:
+        """Patch `config` to use the server instead of the Bitly API."""
+        self._original_config = {name: getattr(config, name) for name in _PATCHED_CONFIG_NAMES}
+        api_base_url = f"http://{self.netloc}/v4"
+        config.API_URL_BITLINKS = f"{api_base_url}/bitlinks"
+        config.API_URL_FORMAT_ORGANIZATION_LIMITS = f"{api_base_url}/organizations/{{organization_guid}}/plan_limits"
+        config.API_URL_ORGANIZATIONS = f"{api_base_url}/organizations"
+        config.API_URL_SHORTEN = f"{api_base_url}/shorten"
+        config.KNOWN_SHORT_DOMAINS = config.KNOWN_SHORT_DOMAINS | {self.netloc}
+        log.debug("Patched config to use fake Bitly server at %s.", self.netloc)
+
+    def restore_config(self) -> None:
+        """Restore `config` as it was before it was patched."""
+        for name, value in self._original_config.items():
+            setattr(config, name, value)
+        self._original_config = {}
+
+    def shorten(self, token: str, long_url: str) -> Tuple[int, Dict[str, Any]]:
+        """Return the status code and response body for a request to shorten the given long URL using the given token."""
+        error = self._error()
+        if error:
+            return error, {"message": "RATE_LIMIT_EXCEEDED" if (error == 429) else "TEMPORARILY_UNAVAILABLE"}
+        parsed_long_url = urlparse(long_url)
+        if not (parsed_long_url.scheme in {"http", "https"} and parsed_long_url.netloc):
+            return 400, {"message": "INVALID_ARG_LONG_URL"}
+        if parsed_long_url.netloc == self.netloc:
+            return 400, {"message": "ALREADY_A_BITLY_LINK"}
+        with self._lock:
+            hash_ = self._links.get((token, long_url))
+            status_code = 200 if hash_ else 201
+            if hash_ is None:
+                hash_ = self._links[(token, long_url)] = hashlib.sha256(f"{token}\n{long_url}".encode()).hexdigest()[:7]
+                self._long_urls[hash_] = long_url
+        return status_code, {"link": f"http://{self.netloc}/{hash_}", "long_url": long_url}
+
+    def start(self) -> None:
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="FakeBitlyServer", daemon=True)
+        self._thread.start()
+        log.info("Started fake Bitly server at %s.", self.netloc)
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+        log.info("Stopped fake Bitly server at %s.", self.netloc)
+
+    def usage(self, token: str) -> int:
+        """Return the number of links created using the given token."""
+        with self._lock:
+            return sum(1 for link_token, _ in self._links if link_token == token)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    fake: FakeBitlyServer
+    request_queue_size = 128  # Prevents connections from being refused when there are many concurrent workers.
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    disable_nagle_algorithm = True  # Prevents delaying the response body which is written separately from its headers.
+    protocol_version = "HTTP/1.1"  # Allows persistent connections.
+
+    @property
+    def fake(self) -> FakeBitlyServer:
+        """Return the fake server."""
+        assert isinstance(self.server, _Server)
+        return self.server.fake
+
+    def _send(self, status_code: int, body: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None) -> None:
+        content = json.dumps(body).encode() if (body is not None) else b""
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def _token(self) -> Optional[str]:
+        authorization = self.headers.get("Authorization", "")
+        return authorization[len("Bearer ") :] if authorization.startswith("Bearer ") else None
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Respond to the organizations and plan_limits endpoints."""
+        fake = self.fake
+        path = self.path
+        fake.count_request(path.rpartition("/")[-1] if path.endswith("/plan_limits") else path)
+        fake.delay()
+        token = self._token()
+        if token is None:
+            self._send(403, {"message": "FORBIDDEN"})
+        elif path == "/v4/organizations":
+            self._send(200, {"organizations": [{"guid": fake.organization_guid(token)}]})
+        elif path == f"/v4/organizations/{fake.organization_guid(token)}/plan_limits":
+            self._send(200, {"plan_limits": [{"name": "encodes", "count": fake.usage(token), "limit": fake.encodes_limit}]})
+        else:
+            self._send(404, {"message": "NOT_FOUND"})
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        """Respond to a short URL with a redirect to its long URL."""
+        fake = self.fake
+        fake.count_request("HEAD")
+        fake.delay()
+        long_url = fake.long_url(self.path.lstrip("/"))
+        if long_url is None:
+            self._send(404)
+        else:
+            self._send(301, headers={"Location": long_url})
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Respond to the shorten and bitlinks endpoints."""
+        fake = self.fake
+        path = self.path
+        fake.count_request(path)
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            body = None
+        fake.delay()
+        token = self._token()
+        if token is None:
+            self._send(403, {"message": "FORBIDDEN"})
+        elif not isinstance(body, dict):
+            self._send(400, {"message": "INVALID_ARG_BODY"})
+        elif path in ("/v4/shorten", "/v4/bitlinks"):
+            status_code, response_body = fake.shorten(token, str(body.get("long_url", "")))
+            self._send(status_code, response_body, {"Retry-After": "1"} if (status_code == 429) else None)
+        else:
+            self._send(404, {"message": "NOT_FOUND"})
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        log.debug(format, *args)
@@ -0,0 +1,249 @@
+"""Instrumentation of requests and caches using metrics and tracing.
+
+`PrometheusInstrumentation` requires the optional `prometheus-client` package which can be installed using `pip install bitlyshortener[prometheus]`.
+`OpenTelemetryInstrumentation` requires the optional `opentelemetry-api` package which can be installed using `pip install bitlyshortener[opentelemetry]`.
+"""
+import bisect
+import contextlib
+import threading
+from typing import Any, ContextManager, Dict, List, Optional, Sequence, Tuple
+
+from . import config
+
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds.
+_ATTEMPTS_BUCKETS = (1.0, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0, 16.0)
+
+METRICS: Dict[str, Tuple[str, str, Tuple[str, ...], Sequence[float]]] = {  # name -> (type, description, label names, histogram buckets)
+    "attempts_per_url": ("histogram", "Number of attempts made for shortening a long URL.", (), _ATTEMPTS_BUCKETS),
+    "circuit_breaker_state": ("gauge", "State of a circuit breaker, which is 0 if closed, 1 if half-open, and 2 if open.", ("kind", "target"), ()),
+    "cache_lookups_total": ("counter", "Number of cache lookups.", ("cache", "result"), ()),
+    "executor_queue_depth": ("gauge", "Approximate number of long URLs waiting for a worker thread.", (), ()),
+    "lengthen_requests_total": ("counter", "Number of requests for the long URL of a short URL.", ("status",), ()),
+    "request_duration_seconds": ("histogram", "Duration of shortening requests.", ("endpoint",), _DURATION_BUCKETS),
+    "requests_total": ("counter", "Number of shortening requests.", ("endpoint", "status"), ()),
+    "token_errors_total": ("counter", "Number of shortening requests which received a rate limit error or a server error.", ("token", "status"), ()),
+}
+
+
+class Instrumentation:
+    """Instrumentation which does nothing.
+
+    A subclass records metrics by overriding `count`, `observe` and `set_gauge`, and traces requests by overriding `span`.
+    The names, types and label names of the metrics are in `METRICS`. The label value of a token is its first four
+    characters, as tokens must not be exposed. The status label value is the response status code, or "error" if no
+    response was received.
+
+    As long as `enabled` is false, the shortener skips calling any of the methods and computing their arguments.
+    """
+
+    enabled = False
+
+    def count(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increment the counter having the given name and labels by the given value."""
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Observe the given value in the histogram having the given name and labels."""
+
+    def record_attempts(self, num_attempts: int) -> None:
+        """Record the number of attempts made for shortening a long URL."""
+        self.observe("attempts_per_url", num_attempts)
+
+    def record_breaker_state(self, kind: str, target: str, state: str) -> None:
+        """Record the state of the circuit breaker of the given target of the given kind, which is "endpoint" or "token"."""
+        self.set_gauge("circuit_breaker_state", {"closed": 0, "half_open": 1, "open": 2}[state], kind=kind, target=target)
+
+    def record_cache_lookup(self, cache: str, hit: bool, *, num_lookups: int = 1) -> None:
+        """Record a number of lookups in the given cache, which is one of "shorten", "lengthen", "negative" and "store"."""
+        if num_lookups:
+            self.count("cache_lookups_total", num_lookups, cache=cache, result="hit" if hit else "miss")
+
+    def record_lengthen_request(self, status_code: Optional[int]) -> None:
+        """Record a request for the long URL of a short URL."""
+        self.count("lengthen_requests_total", status="error" if (status_code is None) else str(status_code))
+
+    def record_queue_depth(self, depth: int) -> None:
+        """Record the number of long URLs waiting for a worker thread."""
+        self.set_gauge("executor_queue_depth", depth)
+
+    def record_request(self, endpoint: str, token: str, status_code: Optional[int], time_used: float) -> None:
+        """Record a shortening request.
+
+        :param endpoint: URL of the endpoint.
+        :param token: token which was used.
+        :param status_code: response status code, or None if no response was received.
+        :param time_used: seconds used for the request.
+        """
+        endpoint = endpoint.rpartition("/")[-1]
+        status = "error" if (status_code is None) else str(status_code)
+        self.count("requests_total", endpoint=endpoint, status=status)
+        self.observe("request_duration_seconds", time_used, endpoint=endpoint)
+        if (status_code == 429) or ((status_code is not None) and (status_code >= 500)):
+            self.count("token_errors_total", token=token[:4], status=status)
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set the gauge having the given name and labels to the given value."""
+
+    def span(self, name: str, **attributes: Any) -> ContextManager:  # pylint: disable=unused-argument
+        """Return a context manager which traces the given operation having the given attributes."""
+        return contextlib.nullcontext()
+
+
+class CompositeInstrumentation(Instrumentation):
+    """Instrumentation which delegates to each of the given instrumentations, such as for both metrics and tracing."""
+
+    enabled = True
+
+    def __init__(self, *instrumentations: Instrumentation):
+        self._instrumentations = [instrumentation for instrumentation in instrumentations if instrumentation.enabled]
+
+    def count(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increment the counter having the given name and labels by the given value."""
+        for instrumentation in self._instrumentations:
+            instrumentation.count(name, value, **labels)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Observe the given value in the histogram having the given name and labels."""
+        for instrumentation in self._instrumentations:
+            instrumentation.observe(name, value, **labels)
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set the gauge having the given name and labels to the given value."""
+        for instrumentation in self._instrumentations:
+            instrumentation.set_gauge(name, value, **labels)
+
+    def span(self, name: str, **attributes: Any) -> ContextManager:
+        """Return a context manager which traces the given operation having the given attributes."""
+        stack = contextlib.ExitStack()
+        for instrumentation in self._instrumentations:
+            stack.enter_context(instrumentation.span(name, **attributes))
+        return stack
+
+
+class MetricsInstrumentation(Instrumentation):
+    """Thread-safe instrumentation which records metrics in memory, and renders them in the Prometheus text format.
+
+    It requires no optional dependency.
+    """
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self._values: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Any] = {}  # (name, labels) -> value, or [bucket counts, sum, count] for a histogram.
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increment the counter having the given name and labels by the given value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Observe the given value in the histogram having the given name and labels."""
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRICS[name][3]
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            values = sorted(self._values.items())
+        lines: List[str] = []
+        described = set()
+        for (name, labels), value in values:
+            full_name = f"{config.PACKAGE_NAME}_{name}"
+            metric_type, description, _, buckets = METRICS[name]
+            if name not in described:
+                lines += [f"# HELP {full_name} {description}", f"# TYPE {full_name} {metric_type}"]
+                described.add(name)
+            if metric_type != "histogram":
+                lines.append(f"{full_name}{_format_labels(labels)} {value}")
+                continue
+            lines += _render_histogram(full_name, labels, buckets, value)
+        return "".join(line + "\n" for line in lines)
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set the gauge having the given name and labels to the given value."""
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def value(self, name: str, **labels: str) -> Any:
+        """Return the value of the counter or gauge, or the (bucket counts, sum, count) of the histogram, having the given name and labels, or None if it has no value."""
+        with self._lock:
+            value = self._values.get((name, tuple(sorted(labels.items()))))
+            return (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """Instrumentation which traces requests as OpenTelemetry spans.
+
+    :param tracer: tracer. It defaults to the tracer of the package from the global tracer provider.
+    """
+
+    enabled = True
+
+    def __init__(self, tracer: Any = None):
+        from opentelemetry import trace  # pylint: disable=import-outside-toplevel
+
+        self._tracer = tracer or trace.get_tracer(config.PACKAGE_NAME)
+
+    def span(self, name: str, **attributes: Any) -> ContextManager:
+        """Return a context manager which traces the given operation having the given attributes."""
+        return self._tracer.start_as_current_span(f"{config.PACKAGE_NAME}.{name}", attributes=attributes)
+
+
+class PrometheusInstrumentation(Instrumentation):
+    """Instrumentation which records metrics using the Prometheus client.
+
+    :param registry: registry of the metrics. It defaults to the default registry of the Prometheus client.
+    """
+
+    enabled = True
+
+    def __init__(self, registry: Any = None):
+        import prometheus_client  # pylint: disable=import-outside-toplevel
+
+        metric_classes = {"counter": prometheus_client.Counter, "gauge": prometheus_client.Gauge, "histogram": prometheus_client.Histogram}
+        registry = registry or prometheus_client.REGISTRY
+        self._metrics: Dict[str, Any] = {}
+        for name, (metric_type, description, label_names, buckets) in METRICS.items():
+            kwargs: Dict[str, Any] = {"buckets": buckets} if buckets else {}
+            metric_name = name[: -len("_total")] if (metric_type == "counter") else name  # The Prometheus client appends the suffix.
+            self._metrics[name] = metric_classes[metric_type](metric_name, description, label_names, namespace=config.PACKAGE_NAME, registry=registry, **kwargs)
+
+    def _metric(self, name: str, labels: Dict[str, str]) -> Any:
+        metric = self._metrics[name]
+        return metric.labels(**labels) if labels else metric
+
+    def count(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Increment the counter having the given name and labels by the given value."""
+        self._metric(name, labels).inc(value)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Observe the given value in the histogram having the given name and labels."""
+        self._metric(name, labels).observe(value)
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set the gauge having the given name and labels to the given value."""
+        self._metric(name, labels).set(value)
+
+
+def _render_histogram(full_name: str, labels: Tuple[Tuple[str, str], ...], buckets: Sequence[float], value: List[Any]) -> List[str]:
+    bucket_counts, total, num_observations = value
+    lines, cumulative_count = [], 0
+    for bound, bucket_count in zip([*buckets, "+Inf"], bucket_counts):
+        cumulative_count += bucket_count
+        lines.append(f"{full_name}_bucket{_format_labels((*labels, ('le', str(bound))))} {cumulative_count}")
+    return lines + [f"{full_name}_sum{_format_labels(labels)} {total}", f"{full_name}_count{_format_labels(labels)} {num_observations}"]
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped_labels = (name + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for name, value in labels)
+    return "{" + ",".join(escaped_labels) + "}"
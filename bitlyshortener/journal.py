@@ -0,0 +1,136 @@
+"""Append-only journal of long URL to short URL mappings."""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+
+class Journal:
+    """Thread-safe append-only journal of long URL to short URL mappings, for resuming a bulk job after a crash.
+
+    Each entry is written as a JSON line. Entries are flushed to disk with fsync once `config.JOURNAL_FSYNC_ENTRIES`
+    entries are pending or an entry has been pending for `config.JOURNAL_FSYNC_INTERVAL` seconds, whichever is first,
+    including if no further entries are appended, and when the journal is closed. As such, a crash loses no more than
+    the entries which are pending. A partially written last line from a crash is removed when the journal is opened.
+
+    The journal should be closed when no longer needed, such as by using it as a context manager.
+
+    :param path: path of the journal file. It is created if it doesn't exist.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._repair()
+        self._file = self._path.open("a", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._num_pending = 0
+        self._flushed = time.monotonic()
+        self._timer: Optional[threading.Timer] = None  # Flushes entries which remain pending.
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(path={str(self._path)!r})"
+
+    def _flush(self) -> None:  # Lock must be held.
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._num_pending = 0
+        self._flushed = time.monotonic()
+
+    def _flush_pending(self) -> None:
+        with self._lock:
+            self._timer = None
+            if self._num_pending and not self._file.closed:
+                self._flush()
+
+    def _repair(self) -> None:
+        if not self._path.exists():
+            return
+        with self._path.open("rb+") as file:
+            file.seek(0, os.SEEK_END)
+            size = file.tell()
+            if size == 0:
+                return
+            file.seek(size - 1)
+            if file.read(1) == b"\n":
+                return
+            size_to_keep, end = 0, size  # Is 0 if there is no newline.
+            while end > 0:  # Reads backward in chunks until a newline is found.
+                start = max(0, end - 65536)
+                file.seek(start)
+                newline_index = file.read(end - start).rfind(b"\n")
+                if newline_index != -1:
+                    size_to_keep = start + newline_index + 1
+                    break
+                end = start
+            file.truncate(size_to_keep)
+        log.warning("Removed partially written last line of journal %s, truncating it from %s to %s bytes.", self._path, size, size_to_keep)
+
+    def append(self, long_url: str, short_url: str) -> None:
+        """Append an entry for the given long URL and short URL."""
+        line = json.dumps([long_url, short_url]) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._num_pending += 1
+            if (self._num_pending >= config.JOURNAL_FSYNC_ENTRIES) or ((time.monotonic() - self._flushed) >= config.JOURNAL_FSYNC_INTERVAL):
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(config.JOURNAL_FSYNC_INTERVAL, self._flush_pending)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def close(self) -> None:
+        """Flush any pending entries and close the journal."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._file.closed:
+                self._flush()
+                self._file.close()
+                log.debug("Closed journal %s.", self._path)
+
+    def entries(self) -> Iterator[Tuple[str, str]]:
+        """Yield the (long URL, short URL) entries in the order in which they were appended."""
+        with self._lock:
+            if not self._file.closed:
+                self._flush()  # Allows reading pending entries.
+        with self._path.open(encoding="utf-8") as file:
+            for line in file:
+                long_url, short_url = json.loads(line)
+                yield long_url, short_url
+
+    def export_file(self, path: Union[str, Path]) -> int:
+        """Write the latest short URL of each long URL to the given file in the format of `BaseCache.export_file`, and return the number of entries.
+
+        The file can be used to preload a cache using `BaseCache.import_file`.
+        """
+        mapping = self.load()
+        with Path(path).open("w", encoding="utf-8") as file:
+            for item in mapping.items():
+                file.write(json.dumps(item) + "\n")
+        log.info("Exported %s entries of journal %s to %s.", len(mapping), self._path, path)
+        return len(mapping)
+
+    def flush(self) -> None:
+        """Flush any pending entries to disk."""
+        with self._lock:
+            self._flush()
+
+    def load(self) -> Dict[str, str]:
+        """Return a mapping of the latest short URL of each long URL."""
+        mapping = dict(self.entries())
+        log.debug("Loaded %s entries from journal %s.", len(mapping), self._path)
+        return mapping
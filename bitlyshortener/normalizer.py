@@ -0,0 +1,77 @@
+"""Normalizer of long URLs."""
+import logging
+import re
+from typing import Dict, List, Optional, Sequence
+
+from . import config, exc
+
+log = logging.getLogger(__name__)
+
+STEPS = ("strip", "lowercase_host", "remove_default_port", "add_root_path", "remove_fragment", "remove_trailing_slash")  # In order of application.
+
+_DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+_URL_PATTERN = re.compile(r"([A-Za-z][A-Za-z0-9+.-]*)://([^/?#]*)(.*)", re.DOTALL)  # Captures scheme, authority, and the rest.
+
+
+class URLNormalizer:
+    """Normalizer of long URLs, so that equivalent long URLs share a cache entry and a request.
+
+    The available steps are:
+    * strip: strip surrounding whitespace.
+    * lowercase_host: lowercase the scheme and host, e.g. HTTPS://Example.COM/Path -> https://example.com/Path.
+    * remove_default_port: remove a port which is the default for the scheme, e.g. https://example.com:443/ -> https://example.com/.
+    * add_root_path: add the root path if the path is empty, e.g. https://example.com -> https://example.com/.
+    * remove_fragment: remove the fragment, e.g. https://example.com/#top -> https://example.com/.
+    * remove_trailing_slash: remove the trailing slash of a non-root path, e.g. https://example.com/a/ -> https://example.com/a.
+
+    The last two steps can change the page which is linked to for some sites, and are therefore not used by default.
+    A string which is not an absolute URL is only stripped.
+
+    :param steps: names of the steps to use. They are always applied in the above order. The default is `config.DEFAULT_URL_NORMALIZATION_STEPS`.
+    """
+
+    def __init__(self, steps: Optional[Sequence[str]] = None):
+        self._steps = frozenset(config.DEFAULT_URL_NORMALIZATION_STEPS if (steps is None) else steps)
+        self._check_args()
+        self._strip, self._lowercase_host, self._remove_default_port, self._add_root_path, self._remove_fragment, self._remove_trailing_slash = (
+            step in self._steps for step in STEPS
+        )
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(steps={[step for step in STEPS if step in self._steps]})"
+
+    def _check_args(self) -> None:
+        unknown_steps = self._steps - set(STEPS)
+        if unknown_steps:
+            raise exc.ArgsError(f"URL normalization steps must be among {list(STEPS)}, but they include {sorted(unknown_steps)}.")
+
+    def normalize(self, url: str) -> str:
+        """Return the normalized form of the given URL."""
+        if self._strip:
+            url = url.strip()
+        match = _URL_PATTERN.fullmatch(url)
+        if match is None:
+            return url
+        scheme, authority, rest = match.groups()
+        if self._lowercase_host:
+            scheme = scheme.lower()
+            userinfo, at_sign, host = authority.rpartition("@")
+            authority = userinfo + at_sign + host.lower()
+        if self._remove_default_port:
+            default_port = _DEFAULT_PORTS.get(scheme.lower())
+            if default_port and authority.endswith(default_port):
+                authority = authority[: -len(default_port)]
+        if self._remove_fragment:
+            rest = rest.partition("#")[0]
+        if self._add_root_path and not rest.startswith("/"):
+            rest = "/" + rest
+        if self._remove_trailing_slash:
+            path_end = min((index for index in (rest.find("?"), rest.find("#")) if index != -1), default=len(rest))
+            if (path_end > 1) and (rest[path_end - 1] == "/"):
+                rest = rest[: path_end - 1] + rest[path_end:]
+        return f"{scheme}://{authority}{rest}"
+
+    def normalize_batch(self, urls: List[str]) -> List[str]:
+        """Return the normalized forms of the given URLs, normalizing each distinct URL only once."""
+        normalized_urls: Dict[str, str] = {url: self.normalize(url) for url in dict.fromkeys(urls)}
+        return [normalized_urls[url] for url in urls]
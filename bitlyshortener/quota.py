@@ -0,0 +1,59 @@
+"""Tracker of the monthly URL shortening quota of each token."""
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+
+class QuotaTracker:
+    """Thread-safe tracker of the monthly URL shortening quota of each token.
+
+    The usage and limit of each token are updated from the API, and in between, the usage is incremented locally for
+    each short URL which is created. A token is nearly exhausted if its remaining quota is no more than a reserved
+    fraction of its limit, which is `config.QUOTA_RESERVE`. The reserve allows for usage which is not tracked locally,
+    such as by other processes.
+    """
+
+    def __init__(self, tokens: List[str]):
+        self._used: Dict[str, int] = {token: 0 for token in tokens}
+        self._limits: Dict[str, Optional[int]] = {token: None for token in tokens}  # None until updated.
+        self._updated: Optional[float] = None  # Monotonic time of last update.
+        self._lock = threading.Lock()
+
+    def is_exhausted(self, token: str) -> bool:
+        """Return whether the quota of the given token is nearly exhausted."""
+        limit = self._limits[token]
+        return (limit is not None) and ((limit - self._used[token]) <= (limit * config.QUOTA_RESERVE))
+
+    def is_stale(self) -> bool:
+        """Return whether the quotas have not been updated from the API in the last `config.USAGE_CACHE_TIME` seconds."""
+        updated = self._updated
+        return (updated is None) or ((time.monotonic() - updated) > config.USAGE_CACHE_TIME)
+
+    def record(self, token: str, status_code: int) -> None:
+        """Record the response status code of a shortening request using the given token."""
+        if status_code == 201:  # Created, whereas 200 is for a preexisting short URL which doesn't use quota.
+            with self._lock:
+                self._used[token] += 1
+                used, limit = self._used[token], self._limits[token]
+            if (limit is not None) and ((limit - used) == int(limit * config.QUOTA_RESERVE)):
+                log.warning("Quota of token starting with %s is nearly exhausted with %s of %s used.", token[:4], used, limit)
+
+    def update(self, usages: Dict[str, Dict[str, int]]) -> None:
+        """Update the quotas using the given usage of each token as returned by the API."""
+        with self._lock:
+            for token, usage in usages.items():
+                self._used[token], self._limits[token] = usage["used"], usage["limit"]
+            self._updated = time.monotonic()
+        log.debug("Updated quotas of %s tokens. %s of them are nearly exhausted.", len(usages), sum(self.is_exhausted(token) for token in usages))
+
+    def usage(self) -> float:
+        """Return the fraction of the quota used across all tokens whose quota is known."""
+        with self._lock:
+            tokens = [token for token, limit in self._limits.items() if limit is not None]
+            total_limit = sum(self._limits[token] or 0 for token in tokens)
+            return (sum(self._used[token] for token in tokens) / total_limit) if total_limit else 0.0
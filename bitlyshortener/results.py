@@ -0,0 +1,69 @@
+"""Results of shortening."""
+import dataclasses
+from typing import Dict, List, Optional
+
+from . import exc
+
+
+@dataclasses.dataclass(frozen=True)
+class ShortenResult:
+    """Result of shortening a long URL.
+
+    :param long_url: long URL as given.
+    :param short_url: short URL, or None if there was an error.
+    :param error: error which prevented shortening the long URL, or None if there was no error.
+    :param time_used: seconds used for shortening the long URL.
+    :param token: token which was used for creating the short URL, or None if no request was made for it.
+    """
+
+    long_url: str
+    short_url: Optional[str]
+    error: Optional[exc.RequestError]
+    time_used: float
+    token: Optional[str] = dataclasses.field(default=None, repr=False)  # Tokens must not be logged.
+
+    @property
+    def succeeded(self) -> bool:
+        """Return whether the long URL was shortened."""
+        return self.error is None
+
+
+@dataclasses.dataclass(frozen=True)
+class BatchResult:
+    """Results of shortening a batch of long URLs, in the order of the long URLs.
+
+    :param results: result for each long URL.
+    :param time_used: seconds used for shortening the batch.
+    """
+
+    results: List[ShortenResult]
+    time_used: float
+
+    @property
+    def failed(self) -> List[ShortenResult]:
+        """Return the results which have an error."""
+        return [result for result in self.results if not result.succeeded]
+
+    @property
+    def failed_long_urls(self) -> List[str]:
+        """Return the long URLs which were not shortened, such as to retry them."""
+        return [result.long_url for result in self.results if not result.succeeded]
+
+    @property
+    def succeeded(self) -> bool:
+        """Return whether all long URLs were shortened."""
+        return all(result.succeeded for result in self.results)
+
+    @property
+    def short_urls(self) -> List[Optional[str]]:
+        """Return the short URLs, with None for each long URL which was not shortened."""
+        return [result.short_url for result in self.results]
+
+
+def fan_out_results(long_urls: List[str], normalized_long_urls: List[str], unique_results: Dict[str, ShortenResult]) -> List[ShortenResult]:
+    """Return the result of each of the given long URLs from the results of the unique normalized long URLs, with the long URL as given."""
+    results = []
+    for long_url, normalized_long_url in zip(long_urls, normalized_long_urls):
+        result = unique_results[normalized_long_url]
+        results.append(result if (result.long_url == long_url) else dataclasses.replace(result, long_url=long_url))
+    return results
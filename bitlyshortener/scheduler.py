@@ -0,0 +1,361 @@
+"""Schedulers of requests across the pool of tokens."""
+import collections
+import logging
+import random
+import threading
+import time
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple, cast
+
+from . import config
+from .quota import QuotaTracker
+
+log = logging.getLogger(__name__)
+
+
+class TokenScheduler:
+    """Scheduler of requests across the pool of tokens.
+
+    Each token has a token bucket which limits its sustained request rate to `rate` per second with bursts of up to `burst`. A token that receives a rate limit error or
+    a server error is throttled for a cooldown period which grows exponentially with consecutive errors. A token whose quota is nearly exhausted as per the optional quota
+    tracker is avoided similarly to a throttled token.
+
+    All methods are thread-safe and none of them block.
+    """
+
+    def __init__(self, tokens: List[str], *, rate: Optional[float] = None, burst: Optional[float] = None, quota: Optional[QuotaTracker] = None):
+        self._rate = rate or config.TOKEN_RATE_LIMIT  # Not a default argument so that config can be changed at runtime.
+        self._burst = burst or config.TOKEN_BURST_LIMIT
+        now = time.monotonic()
+        self._levels: Dict[str, float] = {token: self._burst for token in tokens}
+        self._updated: Dict[str, float] = {token: now for token in tokens}
+        self._cooldowns: Dict[str, float] = {token: 0.0 for token in tokens}  # Monotonic time until which a token is throttled.
+        self._num_errors: Dict[str, int] = {token: 0 for token in tokens}  # Consecutive.
+        self._quota = quota
+        self._lock = threading.Lock()
+
+    def is_avoided(self, token: str) -> bool:
+        """Return whether the given token is throttled or its quota is nearly exhausted."""
+        return self.is_throttled(token) or ((self._quota is not None) and self._quota.is_exhausted(token))
+
+    def is_ready(self, token: str) -> bool:
+        """Return whether a request using the given token can be made without waiting."""
+        with self._lock:
+            now = time.monotonic()
+            level = min(self._burst, self._levels[token] + (now - self._updated[token]) * self._rate)
+            return (level >= 1) and (self._cooldowns[token] <= now)
+
+    def is_throttled(self, token: str) -> bool:
+        """Return whether the given token is currently cooling down after an error."""
+        return self._cooldowns[token] > time.monotonic()
+
+    def record(self, token: str, status_code: Optional[int], retry_after: Optional[float] = None) -> None:
+        """Record the outcome of a request using the given token.
+
+        :param token: token which was used.
+        :param status_code: response status code, or None if no response was received.
+        :param retry_after: seconds to wait as advised by the response, if any.
+        """
+        if status_code is None:  # Not specific to the token.
+            return
+        if status_code == 429:
+            base_cooldown = config.TOKEN_RATE_LIMITED_COOLDOWN
+        elif status_code >= 500:
+            base_cooldown = config.TOKEN_ERROR_COOLDOWN
+        else:
+            self._num_errors[token] = 0
+            return
+        with self._lock:
+            if self._cooldowns[token] > time.monotonic():  # Error is from a request made before the token was throttled.
+                return
+            num_errors = self._num_errors[token] = self._num_errors[token] + 1
+            cooldown = min(base_cooldown * (2 ** (num_errors - 1)), config.MAX_TOKEN_COOLDOWN)
+            if retry_after is not None:
+                cooldown = max(cooldown, retry_after)
+            self._cooldowns[token] = time.monotonic() + cooldown
+        log.info("Throttling token starting with %s for %.1fs after %s consecutive errors.", token[:4], cooldown, num_errors)
+
+    def reserve(self, token: str) -> float:
+        """Reserve a request using the given token and return the number of seconds to wait before making it."""
+        with self._lock:
+            now = time.monotonic()
+            level = min(self._burst, self._levels[token] + (now - self._updated[token]) * self._rate) - 1
+            self._levels[token], self._updated[token] = level, now
+            wait = max(-level / self._rate, self._cooldowns[token] - now, 0.0)
+        return wait
+
+    def schedule(self, attempts: List[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+        """Yield the given (endpoint, token) attempts, which are given in the reverse order in which they are to be made.
+
+        An attempt with a throttled or nearly exhausted token is deferred once to the end if an attempt with another token remains.
+        """
+        pending = collections.deque(reversed(attempts))
+        deferred = set()
+        while pending:
+            attempt = pending.popleft()
+            if (attempt not in deferred) and self.is_avoided(attempt[1]) and any(not self.is_avoided(token) for _, token in pending):
+                log.debug("Deferring attempt using endpoint /%s due to throttled or nearly exhausted token starting with %s.", attempt[0].rpartition("/")[-1], attempt[1][:4])
+                deferred.add(attempt)
+                pending.append(attempt)
+                continue
+            yield attempt
+
+
+class AdaptiveLimiter:
+    """Limiter of the number of concurrent requests which adapts to rate limit errors.
+
+    The limit is increased additively after each success and is decreased multiplicatively after each rate limit error.
+    Callers which wait for a request slot are handed freed slots in the order in which they started waiting.
+
+    :param max_limit: max number of concurrent requests.
+    """
+
+    def __init__(self, max_limit: int):
+        self._max_limit = max_limit
+        self._limit = float(max_limit)
+        self._num_active = 0
+        self._decreased = 0.0  # Monotonic time of last decrease.
+        self._lock = threading.Lock()
+        self._waiters: Deque[threading.Event] = collections.deque()  # In order of waiting.
+
+    def __enter__(self) -> None:
+        with self._lock:
+            if (not self._waiters) and (self._num_active < int(self._limit)):
+                self._num_active += 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        waiter.wait()  # The slot is counted as active by the caller which hands it over.
+
+    def __exit__(self, *_args: object) -> None:
+        with self._lock:
+            self._num_active -= 1
+            self._hand_over()
+
+    def _hand_over(self) -> None:  # Lock must be held.
+        while self._waiters and (self._num_active < int(self._limit)):
+            self._num_active += 1
+            self._waiters.popleft().set()
+
+    @property
+    def limit(self) -> int:
+        """Return the current max number of concurrent requests."""
+        return int(self._limit)
+
+    def record(self, status_code: Optional[int]) -> None:
+        """Record the response status code of a request, or None if no response was received."""
+        with self._lock:
+            if status_code == 429:
+                now = time.monotonic()
+                if (now - self._decreased) >= config.MIN_CONCURRENCY_DECREASE_INTERVAL:  # Prevents overreacting to concurrent errors.
+                    self._limit = max(1.0, self._limit / 2)
+                    self._decreased = now
+                    log.info("Decreased concurrency limit to %s.", int(self._limit))
+            elif (status_code is not None) and (status_code < 500):
+                self._limit = min(float(self._max_limit), self._limit + 1 / self._limit)
+                self._hand_over()
+
+
+class LatencyTracker:
+    """Tracker of the recent latencies of requests to each endpoint.
+
+    The latencies of the last `config.LATENCY_WINDOW` requests to each endpoint are tracked, including those of requests which failed or timed out. An endpoint is
+    considered only after `config.MIN_LATENCY_SAMPLES` of its latencies are tracked. The order of the endpoints is recomputed at most once every
+    `config.ENDPOINT_ORDER_INTERVAL` seconds, as it is requested for each long URL.
+
+    All methods are thread-safe and none of them block.
+
+    :param endpoints: endpoints in their default order of preference.
+    """
+
+    def __init__(self, endpoints: Sequence[str]):
+        self._endpoints = tuple(endpoints)
+        self._latencies: Dict[str, Deque[float]] = {endpoint: collections.deque(maxlen=config.LATENCY_WINDOW) for endpoint in self._endpoints}
+        self._lock = threading.Lock()
+        self._order = self._endpoints
+        self._ordered_time = -float("inf")  # Monotonic time.
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Return the seconds after which a request to the given endpoint is to be hedged, or None if too few of its latencies are tracked.
+
+        The delay is the `config.HEDGE_PERCENTILE` percentile of the latencies of the endpoint, but no less than `config.MIN_HEDGE_DELAY`.
+        """
+        latency = self.percentile(endpoint, config.HEDGE_PERCENTILE)
+        return None if (latency is None) else max(latency, config.MIN_HEDGE_DELAY)
+
+    def order(self) -> Tuple[str, ...]:
+        """Return the endpoints in order of increasing median latency, or in their default order if too few of their latencies are tracked.
+
+        With a probability of `config.ENDPOINT_EXPLORATION_RATE`, the order is reversed so that the latencies of the slower endpoint remain known.
+        """
+        now = time.monotonic()
+        if (now - self._ordered_time) >= config.ENDPOINT_ORDER_INTERVAL:  # A concurrent recomputation is harmless.
+            medians = {endpoint: self.percentile(endpoint, 50) for endpoint in self._endpoints}
+            if None not in medians.values():
+                self._order = tuple(sorted(self._endpoints, key=lambda endpoint: cast(float, medians[endpoint])))  # Sort is stable.
+            self._ordered_time = now
+        endpoints = self._order
+        if random.random() < config.ENDPOINT_EXPLORATION_RATE:
+            endpoints = endpoints[::-1]
+        return endpoints
+
+    def percentile(self, endpoint: str, percentile: float) -> Optional[float]:
+        """Return the given percentile of the latencies of the given endpoint, or None if too few of its latencies are tracked."""
+        with self._lock:
+            latencies = sorted(self._latencies[endpoint])
+        if len(latencies) < config.MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def record(self, endpoint: str, latency: float) -> None:
+        """Record the latency in seconds of a request to the given endpoint."""
+        with self._lock:
+            self._latencies[endpoint].append(latency)
+
+
+class HedgeBudget:
+    """Budget of hedged requests, each of which can create a duplicate short URL under another token.
+
+    A request can be hedged only while the number of hedged requests is less than `config.MAX_HEDGE_FRACTION` of the number of requests, and while the number of duplicate
+    short URLs created by hedging plus the number of hedged requests whose outcome is not yet known is less than `config.HEDGE_DUPLICATE_BUDGET`. The number of duplicate
+    short URLs therefore never exceeds the latter.
+
+    All methods are thread-safe and none of them block.
+    """
+
+    def __init__(self) -> None:
+        self._num_requests = 0
+        self._num_hedged = 0
+        self._num_unresolved = 0
+        self._num_duplicates = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Return whether a request can be hedged, in which case `release` must be called once the outcome of the losing request is known."""
+        with self._lock:
+            if (self._num_hedged >= (self._num_requests * config.MAX_HEDGE_FRACTION)) or ((self._num_duplicates + self._num_unresolved) >= config.HEDGE_DUPLICATE_BUDGET):
+                return False
+            self._num_hedged += 1
+            self._num_unresolved += 1
+        return True
+
+    @property
+    def num_duplicates(self) -> int:
+        """Return the number of duplicate short URLs created by hedging."""
+        return self._num_duplicates
+
+    @property
+    def num_hedged(self) -> int:
+        """Return the number of hedged requests."""
+        return self._num_hedged
+
+    def record_request(self) -> None:
+        """Record a request which can be hedged."""
+        with self._lock:
+            self._num_requests += 1
+
+    def release(self, *, duplicate: bool) -> None:
+        """Record the outcome of the losing request of a hedged request, which is whether it created a duplicate short URL."""
+        with self._lock:
+            self._num_unresolved -= 1
+            if duplicate:
+                self._num_duplicates += 1
+                num_duplicates = self._num_duplicates
+        if duplicate:
+            log.info("Hedging created a duplicate short URL. The number of duplicates created by hedging is %s of a budget of %s.", num_duplicates, config.HEDGE_DUPLICATE_BUDGET)
+
+
+class CircuitBreaker:
+    """Circuit breaker of requests for each of a set of keys, such as endpoints or tokens.
+
+    The breaker of a key is closed, allowing requests, until `config.BREAKER_FAILURE_THRESHOLD` consecutive requests for it fail by receiving no response or a server
+    error. It is then open, rejecting requests, for a backoff period which starts at `config.BREAKER_BACKOFF` seconds and doubles each time it reopens, up to
+    `config.MAX_BREAKER_BACKOFF` seconds, with a random jitter of up to half of the period. It is then half-open, allowing a single probe request at a time. The
+    breaker is closed if the probe succeeds and is otherwise reopened. A probe whose outcome isn't recorded within `config.REQUEST_TIMEOUT` seconds, such as if it
+    was not made, allows another probe.
+
+    All methods are thread-safe and none of them block.
+
+    :param kind: kind of the keys for use in log messages and metrics, e.g. "endpoint".
+    :param labels: label of each key for use in log messages and metrics. A label must not expose a token.
+    :param listener: optional function which is called with the kind, the label of a key, and its new state, whenever the state of a key changes.
+    """
+
+    def __init__(self, kind: str, labels: Dict[str, str], *, listener: Optional[Callable[[str, str, str], None]] = None):
+        self._kind = kind
+        self._labels = labels
+        self._listener = listener
+        self._states: Dict[str, str] = {key: "closed" for key in labels}  # Is one of "closed", "open" and "half_open".
+        self._num_failures: Dict[str, int] = {key: 0 for key in labels}  # Consecutive.
+        self._num_openings: Dict[str, int] = {key: 0 for key in labels}  # Consecutive.
+        self._retry_times: Dict[str, float] = {key: 0.0 for key in labels}  # Monotonic time after which an open breaker is half-open.
+        self._probe_times: Dict[str, float] = {key: -float("inf") for key in labels}  # Monotonic time of the last probe.
+        self._lock = threading.Lock()
+
+    def _set_state(self, key: str, state: str) -> None:  # Lock must be held.
+        self._states[key] = state
+        if self._listener is not None:
+            self._listener(self._kind, self._labels[key], state)
+
+    def _wait_time(self, key: str, now: float) -> float:  # Lock must be held.
+        state = self._states[key]
+        if state == "closed":
+            return 0.0
+        if (state == "open") and (now < self._retry_times[key]):
+            return self._retry_times[key] - now
+        return self._probe_times[key] + config.REQUEST_TIMEOUT - now
+
+    def allow(self, key: str) -> bool:
+        """Return whether a request for the given key is allowed, in which case its outcome must be recorded using `record`."""
+        if self._states[key] == "closed":
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self._states[key] == "open":
+                if now < self._retry_times[key]:
+                    return False
+                self._set_state(key, "half_open")
+            if (self._states[key] == "half_open") and ((now - self._probe_times[key]) < config.REQUEST_TIMEOUT):
+                return False
+            self._probe_times[key] = now
+        return True
+
+    def record(self, key: str, *, success: bool) -> None:
+        """Record the outcome of a request for the given key, which is a success if a response other than a server error was received."""
+        if success:
+            if (self._states[key] == "closed") and (self._num_failures[key] == 0):
+                return
+            with self._lock:
+                self._num_failures[key] = self._num_openings[key] = 0
+                if self._states[key] != "closed":
+                    self._set_state(key, "closed")
+                    log.info("Closed circuit breaker of %s %s.", self._kind, self._labels[key])
+            return
+        with self._lock:
+            num_failures = self._num_failures[key] = self._num_failures[key] + 1
+            state = self._states[key]
+            if (state == "open") or ((state == "closed") and (num_failures < config.BREAKER_FAILURE_THRESHOLD)):  # An open breaker is from a request made before it opened.
+                return
+            num_openings = self._num_openings[key] = self._num_openings[key] + 1
+            backoff = min(config.BREAKER_BACKOFF * (2 ** (num_openings - 1)), config.MAX_BREAKER_BACKOFF)
+            backoff += random.uniform(0, backoff / 2)  # Prevents probes for multiple keys and processes from being synchronized.
+            self._retry_times[key] = time.monotonic() + backoff
+            self._set_state(key, "open")
+        log.warning("Opened circuit breaker of %s %s for %.1fs after %s consecutive failed requests.", self._kind, self._labels[key], backoff, num_failures)
+
+    def state(self, key: str) -> str:
+        """Return the state of the breaker of the given key, which is one of "closed", "open" and "half_open"."""
+        state = self._states[key]
+        return "half_open" if ((state == "open") and (time.monotonic() >= self._retry_times[key])) else state
+
+    def states(self) -> Dict[str, str]:
+        """Return the state of the breaker of each key by its label."""
+        return {label: self.state(key) for key, label in self._labels.items()}
+
+    def wait_time(self) -> float:
+        """Return the number of seconds until the breaker of any key allows a request at the latest, which is 0 if one already does.
+
+        A half-open breaker whose probe is pending is considered to allow a request once the probe expires, although it can close sooner.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return max(0.0, min(self._wait_time(key, now) for key in self._states))
@@ -0,0 +1,357 @@
+"""Shortening service which batches the requests of many clients, and its client."""
+import argparse
+import concurrent.futures
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from . import config, exc, util
+from .cache import Cache
+from .results import ShortenResult
+from .shortener import Shortener
+
+log = logging.getLogger(__name__)
+
+_Request = Tuple[List[str], concurrent.futures.Future]  # Long URLs of a client request, and the future of their results.
+
+
+class ShortenerService:
+    """HTTP service which shortens long URLs for many clients using a single shared shortener.
+
+    The requests of clients which arrive within `config.SERVICE_BATCH_WINDOW` seconds of the first one are combined into
+    a batch of up to `config.SERVICE_MAX_BATCH_SIZE` long URLs, which is deduplicated and shortened using the shared
+    cache of the shortener. Up to `config.SERVICE_MAX_CONCURRENT_BATCHES` batches are shortened at a time.
+
+    The service has the endpoints:
+    * POST /shorten: given a JSON object with a list of "long_urls", respond with a JSON object with a list of
+      "short_urls". If any long URL can't be shortened, the status code is 502 and the object instead has an "error", and
+      "errors" having the error of each long URL, which is null for those which were shortened.
+    * GET /stats: respond with a JSON object of statistics.
+
+    It has no dependencies other than those of the shortener, and it can be used with `ShortenerClient`.
+    When used as a context manager, it is started in a background thread and is then stopped.
+
+    :param shortener: shared shortener.
+    :param host: host to listen on if not using a Unix socket.
+    :param port: port to listen on if not using a Unix socket. If 0, an available port is used.
+    :param unix_socket: path of a Unix socket to listen on instead of a host and port.
+    """
+
+    def __init__(self, shortener: Shortener, *, host: str = "127.0.0.1", port: int = config.SERVICE_PORT, unix_socket: Optional[Union[str, Path]] = None):
+        self._shortener = shortener
+        self._unix_socket = unix_socket
+        self._batcher = _Batcher(shortener)
+        self._server: Union[_Server, "_UnixServer"]
+        if unix_socket is None:
+            self._server = _Server((host, port), _RequestHandler)
+            self._url = f"http://{host}:{self._server.server_port}"
+        else:
+            path = Path(unix_socket)
+            if path.exists() and stat.S_ISSOCK(path.stat().st_mode):  # Is stale, such as after a crash.
+                path.unlink()
+            self._server = _UnixServer(str(path), _UnixRequestHandler)  # pylint: disable=possibly-used-before-assignment
+            self._url = f"unix://{path.resolve()}"
+        self._server.service = self
+        self._thread: Optional[threading.Thread] = None  # Is set if started in a background thread.
+
+    def __enter__(self) -> "ShortenerService":
+        self.start()
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """Return the URL of the service for use with `ShortenerClient`."""
+        return self._url
+
+    def _close(self) -> None:
+        self._server.server_close()
+        self._batcher.close()
+        if self._unix_socket is not None:
+            Path(self._unix_socket).unlink()
+
+    def serve_forever(self) -> None:
+        """Serve in the calling thread until interrupted."""
+        log.info("Serving shortener at %s.", self.url)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._close()
+
+    def shorten(self, long_urls: List[str]) -> List[ShortenResult]:
+        """Return the result of shortening each of the given long URLs as part of a batch."""
+        return self._batcher.submit(long_urls).result()
+
+    def start(self) -> None:
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ShortenerService", daemon=True)
+        self._thread.start()
+        log.info("Started shortener service at %s.", self.url)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return statistics of the requests, batches, and shared cache."""
+        return {**self._batcher.stats(), "cache": self._shortener.cache_stats["shorten"].__dict__}
+
+    def stop(self) -> None:
+        """Stop serving."""
+        if self._thread is not None:  # Otherwise shutdown would wait forever for serving to stop.
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._close()
+        log.info("Stopped shortener service at %s.", self.url)
+
+
+class ShortenerClient:
+    """Thread-safe client of a `ShortenerService`, having the same methods for shortening long URLs as `Shortener`.
+
+    Each thread uses its own persistent connection to the service.
+
+    :param url: URL of the service, which is either http://host:port or unix:///path/to/socket.
+    :param timeout: seconds to wait for a response.
+    """
+
+    def __init__(self, url: str, *, timeout: float = config.SERVICE_CLIENT_TIMEOUT):
+        self._url = url
+        self._parsed_url = urlparse(url)
+        self._timeout = timeout
+        if self._parsed_url.scheme not in ("http", "unix"):
+            raise exc.ArgsError(f"Service URL must start with http:// or unix://, but it is {url!r}.")
+        self._thread_local = threading.local()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(url={self._url!r})"
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._thread_local, "connection", None)
+        if connection is None:
+            if self._parsed_url.scheme == "unix":
+                connection = _UnixHTTPConnection(self._parsed_url.path, timeout=self._timeout)
+            else:
+                connection = http.client.HTTPConnection(self._parsed_url.netloc, timeout=self._timeout)
+            self._thread_local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, Dict[str, Any]]:
+        # Can raise: exc.RequestError
+        content = json.dumps(body).encode() if (body is not None) else None
+        for num_attempt in (1, 2):  # The 2nd attempt is for when a persistent connection was closed by the service.
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=content, headers={"Content-Type": "application/json"} if content else {})
+                response = connection.getresponse()
+                return response.status, json.loads(response.read())
+            except (OSError, http.client.HTTPException, ValueError) as exception:
+                connection.close()
+                self._thread_local.connection = None
+                if (num_attempt == 2) or not isinstance(exception, (ConnectionError, http.client.RemoteDisconnected)):
+                    raise exc.RequestError(
+                        f"Error receiving response from shortener service at {self._url}. The error is: {exception.__class__.__qualname__}: {exception}"
+                    ) from None
+        raise AssertionError("Unreachable.")
+
+    def shorten_urls(self, long_urls: List[str]) -> List[str]:
+        """Return a list of short URLs for the given long URLs."""
+        util.check_long_urls(long_urls)
+        if not long_urls:
+            return []
+        status_code, response_body = self._request("POST", "/shorten", {"long_urls": long_urls})
+        if status_code != 200:
+            errors = "; ".join(f"{long_url}: {error}" for long_url, error in zip(long_urls, response_body.get("errors", [])) if error is not None)
+            msg = f"Error from shortener service at {self._url} with status code {status_code}. The error is: {response_body.get('error')}"
+            raise exc.RequestError(f"{msg} The errors are: {errors}" if errors else msg)
+        return response_body["short_urls"]
+
+    def shorten_urls_to_dict(self, long_urls: List[str]) -> Dict[str, str]:
+        """Return a mapping of short URLs for the given long URLs."""
+        short_urls = self.shorten_urls(long_urls)
+        return dict(zip(long_urls, short_urls))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return statistics of the service."""
+        return self._request("GET", "/stats")[1]
+
+
+class _Batcher:
+    def __init__(self, shortener: Shortener):
+        self._shortener = shortener
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.SERVICE_MAX_CONCURRENT_BATCHES, thread_name_prefix="BatchShortener")
+        self._num_requests, self._num_long_urls, self._num_batches = 0, 0, 0
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="Batcher", daemon=True)
+        self._thread.start()
+
+    def _collect(self, request: _Request) -> Tuple[List[_Request], bool]:
+        # Returns the batch of requests starting with the given request, and whether the batcher is closed.
+        batch, num_long_urls = [request], len(request[0])
+        deadline = time.monotonic() + config.SERVICE_BATCH_WINDOW
+        while num_long_urls < config.SERVICE_MAX_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                next_request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if next_request is None:
+                return batch, True
+            batch.append(next_request)
+            num_long_urls += len(next_request[0])
+        return batch, False
+
+    def _run(self) -> None:
+        closed = False
+        while not closed:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch, closed = self._collect(request)
+            self._num_batches += 1
+            self._executor.submit(self._shorten, batch)
+
+    def _shorten(self, batch: List[_Request]) -> None:
+        long_urls = [long_url for request_long_urls, _ in batch for long_url in request_long_urls]
+        log.debug("Shortening batch of %s long URLs from %s requests.", len(long_urls), len(batch))
+        try:
+            results = self._shortener.shorten_urls_batch(long_urls).results
+        except Exception as exception:  # pylint: disable=broad-except  # Is relayed to each request.
+            for _, future in batch:
+                future.set_exception(exception)
+            return
+        start = 0
+        for request_long_urls, future in batch:
+            future.set_result(results[start : start + len(request_long_urls)])
+            start += len(request_long_urls)
+
+    def close(self) -> None:
+        """Shorten any remaining requests and stop."""
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of requests, long URLs, and batches."""
+        with self._stats_lock:
+            return {"requests": self._num_requests, "long_urls": self._num_long_urls, "batches": self._num_batches}
+
+    def submit(self, long_urls: List[str]) -> concurrent.futures.Future:
+        """Return a future of the results of shortening the given long URLs as part of a batch."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._stats_lock:
+            self._num_requests += 1
+            self._num_long_urls += len(long_urls)
+        self._queue.put((long_urls, future))
+        return future
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    disable_nagle_algorithm = True  # Prevents delaying the response body which is written separately from its headers.
+    protocol_version = "HTTP/1.1"  # Allows persistent connections.
+
+    @property
+    def service(self) -> ShortenerService:
+        """Return the service."""
+        return self.server.service  # type: ignore
+
+    def _send(self, status_code: int, body: Dict[str, Any]) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Respond to the stats endpoint."""
+        if self.path == "/stats":
+            self._send(200, self.service.stats())
+        else:
+            self._send(404, {"error": "Not found."})
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Respond to the shorten endpoint."""
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            body = None
+        if self.path != "/shorten":
+            self._send(404, {"error": "Not found."})
+            return
+        long_urls = body.get("long_urls") if isinstance(body, dict) else None
+        if not (isinstance(long_urls, list) and all(isinstance(long_url, str) for long_url in long_urls)):
+            self._send(400, {"error": 'Request body must be a JSON object with a list of "long_urls".'})
+            return
+        results = self.service.shorten(long_urls)
+        errors = [None if (result.error is None) else str(result.error) for result in results]
+        num_errors = sum(error is not None for error in errors)
+        if num_errors:
+            self._send(502, {"error": f"{num_errors} of {len(results)} long URLs couldn't be shortened.", "errors": errors})
+        else:
+            self._send(200, {"short_urls": [result.short_url for result in results]})
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        log.debug(format, *args)
+
+
+class _UnixRequestHandler(_RequestHandler):
+    disable_nagle_algorithm = False  # Is inapplicable to a Unix socket.
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    service: ShortenerService
+    request_queue_size = 128  # Prevents connections from being refused when there are many concurrent clients.
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):  # Is unavailable on Windows.
+
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        service: ShortenerService
+        request_queue_size = 128
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, *, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # pylint: disable=no-member  # Is unavailable on Windows.
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Serve a shortener as per the given command-line arguments until interrupted."""
+    parser = argparse.ArgumentParser(prog=f"{config.PACKAGE_NAME}-service", description="Serve a shared shortener which batches the requests of many clients.")
+    parser.add_argument("-t", "--tokens", default=os.environ.get("BITLY_TOKENS"), help="comma-separated tokens (default: BITLY_TOKENS environment variable)")
+    parser.add_argument("--host", default="127.0.0.1", help="host to listen on (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=config.SERVICE_PORT, help=f"port to listen on (default: {config.SERVICE_PORT})")
+    parser.add_argument("-u", "--unix-socket", help="path of a Unix socket to listen on instead of a host and port")
+    parser.add_argument("--cache-size", type=int, default=config.CLI_CACHE_SIZE, help=f"max number of entries of the shared memory-cache (default: {config.CLI_CACHE_SIZE})")
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="log info messages, or debug messages if repeated")
+    args = parser.parse_args(argv)
+    if not args.tokens:
+        parser.error("tokens must be specified by --tokens or by the BITLY_TOKENS environment variable")
+    logging.basicConfig(level={0: logging.WARNING, 1: logging.INFO}.get(args.verbose, logging.DEBUG), format="%(asctime)s %(name)s:%(levelname)s: %(message)s")
+    shortener = Shortener(tokens=args.tokens.split(","), cache=Cache(args.cache_size))
+    service = ShortenerService(shortener, host=args.host, port=args.port, unix_socket=args.unix_socket)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
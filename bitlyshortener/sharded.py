@@ -0,0 +1,158 @@
+"""Shortener which shards long URLs across worker processes."""
+import concurrent.futures
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from . import config, exc, util
+from .cache import Cache, CacheStats
+from .normalizer import URLNormalizer
+from .results import BatchResult, ShortenResult, fan_out_results
+from .shortener import Shortener
+
+log = logging.getLogger(__name__)
+
+_WORKER_SHORTENER: Dict[str, Shortener] = {}  # Has the shortener of the worker process.
+
+
+class ShardedShortener:
+    """Shortener which shards long URLs across worker processes so as to not be limited by a single process.
+
+    Each long URL is assigned to a shard by its first token, i.e. the token which is attempted first for it, using the
+    same reproducible ordering of tokens as `Shortener`. The long URLs whose first token is the i-th sorted token are
+    shortened by the worker process of shard i modulo the number of shards. Each worker process runs a `Shortener`
+    having all of the tokens, so that the attempts for a long URL are the same as with a single `Shortener`, and so
+    no long URL is shortened under a different token than it would otherwise be. The first attempts using a token are
+    thereby made by a single worker process, and the number of worker threads of each process is limited accordingly.
+
+    The results of the worker processes are merged in the order of the long URLs, and the short URLs are cached in the
+    memory-cache of this process. `partition` can be used to similarly distribute long URLs across hosts.
+
+    The shortener should be closed when no longer needed, such as by using it as a context manager.
+
+    :param tokens: tokens.
+    :param num_shards: number of shards and worker processes. It defaults to the lesser of the number of tokens and the number of CPUs.
+    :param max_cache_size: max number of entries of the memory-cache of this process and of each worker process.
+    """
+
+    def __init__(self, *, tokens: List[str], num_shards: Optional[int] = None, max_cache_size: int = config.DEFAULT_CACHE_SIZE):
+        self._tokens = tokens
+        self._num_shards = num_shards or min(len(tokens), os.cpu_count() or 1)
+        self._max_cache_size = max_cache_size
+        self._check_args()
+        self._tokens = sorted(self._tokens)  # Sorted for subsequent reproducible randomization.
+
+        self._cache = Cache(max_cache_size)
+        self._normalizer = URLNormalizer()
+        self._init_executors()
+
+    def __enter__(self) -> "ShardedShortener":
+        return self
+
+    def __exit__(self, *_args: object) -> None:
+        self.close()
+
+    def _check_args(self) -> None:
+        util.check_tokens(self._tokens)
+        util.check_max_cache_size(self._max_cache_size)
+        num_shards, num_tokens = self._num_shards, len(self._tokens)
+        if not (isinstance(num_shards, int) and (1 <= num_shards <= num_tokens)):
+            raise exc.ArgsError(f"Number of shards must be an integer from 1 to the number of tokens which is {num_tokens}, but it is {num_shards}.")
+        log.debug("Number of shards is %s.", num_shards)
+
+    def _init_executors(self) -> None:
+        config_values = {name: value for name, value in vars(config).items() if name.isupper()}  # Includes changes made at runtime.
+        self._executors = []
+        for shard in range(self._num_shards):
+            num_shard_tokens = len(self._tokens[shard :: self._num_shards])
+            max_workers = min(config.MAX_WORKERS, num_shard_tokens * config.MAX_WORKERS_PER_TOKEN)
+            self._executors.append(
+                concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(self._tokens, self._max_cache_size, max_workers, config_values))
+            )
+        log.debug("Initialized %s worker processes.", self._num_shards)
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        """Return statistics of the memory-cache of this process."""
+        return self._cache.stats()
+
+    def close(self) -> None:
+        """Shut down the worker processes."""
+        for executor in self._executors:
+            executor.shutdown()
+        log.debug("Shut down %s worker processes.", self._num_shards)
+
+    def partition(self, long_urls: List[str]) -> List[List[str]]:
+        """Return the given long URLs partitioned into a list for each shard.
+
+        For distributing long URLs across hosts, each host can shorten the long URLs of a shard using its own shortener
+        having all of the same tokens, with the number of shards being the number of hosts.
+        """
+        util.check_long_urls(long_urls)
+        partitions: List[List[str]] = [[] for _ in range(self._num_shards)]
+        for long_url in long_urls:
+            partitions[util.shard(self._tokens, long_url, self._num_shards)].append(long_url)
+        return partitions
+
+    def shorten_urls(self, long_urls: List[str]) -> List[str]:
+        """Return a list of short URLs for the given long URLs."""
+        batch_result = self.shorten_urls_batch(long_urls)
+        for result in batch_result.results:
+            if result.error is not None:
+                raise result.error
+        return [result.short_url for result in batch_result.results]  # type: ignore
+
+    def shorten_urls_batch(self, long_urls: List[str]) -> BatchResult:
+        """Return the result of shortening each of the given long URLs.
+
+        Unlike `shorten_urls`, an error in shortening a long URL does not prevent returning the short URLs of the other long URLs.
+        """
+        util.check_long_urls(long_urls)
+        start_time = time.monotonic()
+        normalized_long_urls = self._normalizer.normalize_batch(long_urls)
+        unique_results: Dict[str, ShortenResult] = {}
+        uncached_long_urls = []
+        for long_url in dict.fromkeys(normalized_long_urls):
+            short_url = self._cache.get(long_url)
+            if short_url is None:
+                uncached_long_urls.append(long_url)
+            else:
+                unique_results[long_url] = ShortenResult(long_url=long_url, short_url=short_url, error=None, time_used=0.0)
+
+        # Shorten uncached long URLs in shards
+        futures = [self._executors[shard].submit(_shorten_urls_batch, partition) for shard, partition in enumerate(self.partition(uncached_long_urls)) if partition]
+        log.debug("Sharded %s uncached of %s long URLs across %s worker processes.", len(uncached_long_urls), len(long_urls), len(futures))
+        for future in futures:
+            for result in future.result():
+                unique_results[result.long_url] = result
+                if result.short_url is not None:
+                    self._cache.set(result.long_url, result.short_url)
+
+        results = fan_out_results(long_urls, normalized_long_urls, unique_results)
+        batch_result = BatchResult(results=results, time_used=time.monotonic() - start_time)
+        log.info(
+            "Concurrently retrieved %s of %s short URLs using %s worker processes in %.1fs with %s errors.",
+            len(long_urls) - len(batch_result.failed),
+            len(long_urls),
+            len(futures),
+            batch_result.time_used,
+            len(batch_result.failed),
+        )
+        return batch_result
+
+    def shorten_urls_to_dict(self, long_urls: List[str]) -> Dict[str, str]:
+        """Return a mapping of short URLs for the given long URLs."""
+        short_urls = self.shorten_urls(long_urls)
+        return dict(zip(long_urls, short_urls))
+
+
+def _init_worker(tokens: List[str], max_cache_size: int, max_workers: int, config_values: Dict[str, Any]) -> None:
+    for name, value in config_values.items():  # Applies changes made at runtime, such as if the process was spawned.
+        setattr(config, name, value)
+    config.MAX_WORKERS = max_workers
+    _WORKER_SHORTENER["shortener"] = Shortener(tokens=tokens, max_cache_size=max_cache_size)
+
+
+def _shorten_urls_batch(long_urls: List[str]) -> List[ShortenResult]:
+    return _WORKER_SHORTENER["shortener"].shorten_urls_batch(long_urls).results
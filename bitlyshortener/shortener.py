@@ -1,63 +1,196 @@
 """Shortener."""
 import concurrent.futures
+import contextlib
+import functools
+import itertools
 import logging
 import random
 import threading
 import time
-from functools import _CacheInfo, lru_cache
-from typing import Any, Dict, List, cast
-from urllib.parse import urlparse
+from functools import _CacheInfo
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union, cast
 
-import cachetools.func
-import requests
+from . import config, exc, util
+from .cache import BaseCache, Cache, CacheStats
+from .instrumentation import Instrumentation
+from .journal import Journal
+from .normalizer import URLNormalizer
+from .quota import QuotaTracker
+from .results import BatchResult, ShortenResult, fan_out_results
+from .scheduler import AdaptiveLimiter, CircuitBreaker, HedgeBudget, LatencyTracker, TokenScheduler
+from .store import BaseStore
 
-from . import config, exc
+if TYPE_CHECKING:  # requests is otherwise imported lazily, so that importing the package is fast.
+    import requests
 
 log = logging.getLogger(__name__)
 
+_T = TypeVar("_T")
+
 
 class Shortener:
-    """Shortener."""
+    """Shortener.
+
+    If `hedge` is true, the first attempt for a long URL is hedged: if it doesn't complete within a delay which is a high percentile of the recent latencies of its
+    endpoint, another attempt is made using the next token, and the first successful response is used. The losing request is abandoned, but it can nevertheless create
+    a duplicate short URL under the other token, which uses quota. Hedging is therefore limited as per `scheduler.HedgeBudget`.
+
+    Requests pass through a circuit breaker per endpoint and per token, as per `scheduler.CircuitBreaker`. Attempts for which a breaker is open are skipped. If the
+    breakers of all endpoints or of all tokens are open, a long URL fails fast with `exc.CircuitOpenError`, unless `config.MAX_BREAKER_WAIT` is positive, in which
+    case it waits up to as long for a breaker to allow a request. The state of the breakers is available as `breaker_states`.
+    """
 
-    def __init__(self, *, tokens: List[str], max_cache_size: int = config.DEFAULT_CACHE_SIZE):
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        tokens: List[str],
+        max_cache_size: int = config.DEFAULT_CACHE_SIZE,
+        cache: Optional[BaseCache] = None,
+        store: Optional[BaseStore] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        normalizer: Optional[URLNormalizer] = None,
+        lengthen_cache: Optional[BaseCache] = None,
+        track_quota: bool = True,
+        hedge: bool = False,
+    ):
         self._tokens = tokens
         self._max_cache_size = max_cache_size
+        self._cache = Cache(max_cache_size) if (cache is None) else cache  # Instance level cache
+        self._store = store
+        self._instrumentation = Instrumentation() if (instrumentation is None) else instrumentation
+        self._normalizer = URLNormalizer() if (normalizer is None) else normalizer
+        self._lengthen_cache = Cache(max_cache_size) if (lengthen_cache is None) else lengthen_cache
+        self._track_quota = track_quota
+        self._hedge = hedge
         self._check_args()
         self._tokens = sorted(self._tokens)  # Sorted for subsequent reproducible randomization.
 
-        self._shorten_url = lru_cache(maxsize=self._max_cache_size)(self._shorten_url)  # type: ignore  # Instance level cache
+        self._init_cache()
         self._init_executor()
+        self._init_quota()
+        self._scheduler = TokenScheduler(self._tokens, quota=self._quota)
+        self._limiter = AdaptiveLimiter(self._max_workers)
+        self._latencies = LatencyTracker((config.API_URL_SHORTEN, config.API_URL_BITLINKS))
+        self._headers = {token: {"Authorization": f"Bearer {token}", "Content-Type": "application/json"} for token in self._tokens}  # Is precomputed per token.
+        self._hedge_budget = HedgeBudget()
+        self._init_breakers()
         if config.TEST_API_ON_INIT:
             self._test()
 
     def _cache_state(self) -> str:
-        cache_info = self._shorten_url.cache_info()  # type: ignore
-        calls = cache_info.hits + cache_info.misses
-        hit_percentage = ((100 * cache_info.hits) / calls) if (calls != 0) else 0
-        size_percentage = ((100 * cache_info.currsize) / cache_info.maxsize) if cache_info.maxsize else 100
-        cache_state = f"Cache state is: hits={cache_info.hits}, currsize={cache_info.currsize}, " f"hit_rate={hit_percentage:.0f}%, size_rate={size_percentage:.0f}%"
+        stats = self._cache.stats()
+        size_percentage = ((100 * stats.size) / stats.max_size) if stats.max_size else 100
+        cache_state = (
+            f"Cache state is: hits={stats.hits}, currsize={stats.size}, hit_rate={stats.hit_rate:.0%}, size_rate={size_percentage:.0f}%, "
+            f"evictions={stats.evictions}, coalesced={self._num_coalesced}, negative_hits={self._negative_cache.stats().hits}"
+        )
         return cache_state
 
+    def _call_store(self, method: Callable[..., _T], *args: Any, default: _T) -> _T:
+        # Returns the default if the store is unavailable, so that the store is bypassed and only the memory-cache is used.
+        store = cast(BaseStore, self._store)
+        try:
+            return method(*args)
+        except store.errors as exception:
+            log.warning("Error using store %s for %s, and so it is bypassed. The error is: %s: %s", store, method.__name__, exception.__class__.__qualname__, exception)
+            return default
+
     def _check_args(self) -> None:
-        # Check tokens
-        tokens = self._tokens
-        if not (tokens and isinstance(tokens, list) and all(isinstance(token, str) for token in tokens) and (len(tokens) == len(set(tokens)))):
-            raise exc.ArgsError("Tokens must be a list of one or more unique strings.")  # Tokens must not be logged.
-        log.debug("Number of unique tokens is %s.", len(tokens))
-
-        # Check max cache size
-        max_cache_size = self._max_cache_size
-        max_cache_size = cast(Any, max_cache_size)
-        if (not isinstance(max_cache_size, int)) or (max_cache_size < 0):
-            raise exc.ArgsError(f"Max cache size must be an integer ≥0, but it is {max_cache_size}.")
-        log.debug("Max cache size is %s.", max_cache_size)
+        util.check_tokens(self._tokens)
+        util.check_max_cache_size(self._max_cache_size)
+
+        # Check cache
+        if not isinstance(self._cache, BaseCache):
+            raise exc.ArgsError(f"Cache must be None or an instance of {BaseCache.__qualname__}, but it is {self._cache!r}.")
+        log.debug("Cache is %s.", self._cache)
+        if not isinstance(self._lengthen_cache, BaseCache):
+            raise exc.ArgsError(f"Lengthen cache must be None or an instance of {BaseCache.__qualname__}, but it is {self._lengthen_cache!r}.")
+        log.debug("Lengthen cache is %s.", self._lengthen_cache)
+
+        # Check store
+        store = self._store
+        if (store is not None) and not isinstance(store, BaseStore):
+            raise exc.ArgsError(f"Store must be None or an instance of {BaseStore.__qualname__}, but it is {store!r}.")
+        log.debug("Store is %s.", store)
+
+        # Check instrumentation
+        if not isinstance(self._instrumentation, Instrumentation):
+            raise exc.ArgsError(f"Instrumentation must be None or an instance of {Instrumentation.__qualname__}, but it is {self._instrumentation!r}.")
+
+        # Check normalizer
+        if not isinstance(self._normalizer, URLNormalizer):
+            raise exc.ArgsError(f"Normalizer must be None or an instance of {URLNormalizer.__qualname__}, but it is {self._normalizer!r}.")
+        log.debug("Normalizer is %s.", self._normalizer)
+
+    def _check_quota(self, long_url: str) -> None:
+        # Can raise: exc.RequestError
+        if self._track_quota and self._quota.is_stale():
+            self._start_quota_refresh()
+        if all(self._quota.is_exhausted(token) for token in self._tokens):
+            raise exc.RequestError(f"Not requesting short URL for long URL {long_url} as the quota of all {len(self._tokens)} tokens is nearly exhausted.")
 
     @staticmethod
-    def _check_long_urls(long_urls: List[str]) -> None:
-        if not (isinstance(long_urls, list) and all(isinstance(long_url, str) for long_url in long_urls)):
-            raise exc.ArgsError("Long URLs must be a list of URL strings.")
+    def _future_result(future: concurrent.futures.Future) -> Union[str, exc.RequestError]:
+        try:
+            return future.result()
+        except exc.RequestError as exception:
+            return exception
+
+    def _allowed_attempts(self, attempts: List[Tuple[str, str]], long_url: str) -> Iterator[Tuple[str, str]]:
+        # Can raise: exc.CircuitOpenError
+        # Yields the scheduled attempts which are allowed by the circuit breakers. If the caller exhausts the yielded attempts, it is because they all failed.
+        deadline = time.monotonic() + config.MAX_BREAKER_WAIT
+        num_allowed = 0
+        while not num_allowed:  # Is reattempted if another request took the probe of a half-open breaker.
+            self._wait_for_breakers(long_url, deadline)
+            for endpoint, token in self._scheduler.schedule(attempts):
+                # Note: A half-open breaker of the endpoint can allow a probe which is then not made as the breaker of the token is open, but such a probe expires.
+                if self._endpoint_breaker.allow(endpoint) and self._token_breaker.allow(token):
+                    num_allowed += 1
+                    yield endpoint, token
+        if num_allowed < len(attempts):
+            msg = f"Made {num_allowed} of {len(attempts)} attempts for long URL {long_url}, with the rest not made as their circuit breakers are open or probing."
+            raise exc.CircuitOpenError(msg)
+
+    def _init_breakers(self) -> None:
+        instrumentation = self._instrumentation
+        listener = instrumentation.record_breaker_state if instrumentation.enabled else None
+        endpoints = (config.API_URL_SHORTEN, config.API_URL_BITLINKS)
+        self._endpoint_breaker = CircuitBreaker("endpoint", {endpoint: endpoint.rpartition("/")[-1] for endpoint in endpoints}, listener=listener)
+        self._token_breaker = CircuitBreaker("token", {token: token[:4] for token in self._tokens}, listener=listener)
+
+    def _init_cache(self) -> None:
+        self._short_url_normalizer = URLNormalizer(config.DEFAULT_SHORT_URL_NORMALIZATION_STEPS)
+        self._negative_cache = Cache(config.NEGATIVE_CACHE_SIZE, policy="ttl", ttl=config.NEGATIVE_CACHE_TTL)  # For long URLs which can't be shortened.
+        self._inflight: Dict[str, concurrent.futures.Future] = {}  # Keyed by long URL.
+        self._inflight_lock = threading.Lock()
+        self._num_coalesced = 0
+        if self._store is not None:
+            num_url_pairs = self._cache.warm(self._call_store(self._store.recent, self._cache.stats().max_size, default=[]))
+            log.debug("Warmed cache with %s URLs from store. %s", num_url_pairs, self._cache_state())
+
+    def _init_quota(self) -> None:
+        self._quota = QuotaTracker(self._tokens)
+        self._quota_refresh_lock = threading.Lock()  # Held while refreshing in the background.
+        self._quota_refresh_attempted = -float("inf")  # Monotonic time.
+
+    def _get_executor(self, thread_name_prefix: str = "Requester") -> concurrent.futures.ThreadPoolExecutor:
+        # Executors are created on first use, so that a shortener which is used only serially creates none.
+        executor = self._executors.get(thread_name_prefix)
+        if executor is None:
+            with self._executors_lock:
+                executor = self._executors.get(thread_name_prefix)
+                if executor is None:
+                    max_workers = (2 * self._max_workers) if (thread_name_prefix == "Hedger") else self._max_workers  # A hedged request uses two workers.
+                    executor = self._executors[thread_name_prefix] = concurrent.futures.ThreadPoolExecutor(  # pylint: disable=consider-using-with
+                        max_workers=max_workers, thread_name_prefix=thread_name_prefix
+                    )
+                    log.debug("Initialized %s thread pool executor.", thread_name_prefix)
+        return executor
 
     def _init_requests_session(self) -> None:
+        import requests  # pylint: disable=import-outside-toplevel
+
         self._thread_local.session_get = requests.Session()
         self._thread_local.session_head = requests.Session()
         self._thread_local.session_post = requests.Session()
@@ -67,32 +200,77 @@ class Shortener:
         self._max_workers = min(config.MAX_WORKERS, len(self._tokens) * config.MAX_WORKERS_PER_TOKEN)
         log.debug("Max number of worker threads is %s.", self._max_workers)
         self._thread_local = threading.local()
-        self._init_requests_session()  # For conditional non-parallel execution.
-        self._executor = concurrent.futures.ThreadPoolExecutor(  # pylint: disable=consider-using-with
-            max_workers=self._max_workers, thread_name_prefix="Requester", initializer=self._init_requests_session
+        self._executors: Dict[str, concurrent.futures.ThreadPoolExecutor] = {}  # Keyed by thread name prefix.
+        self._executors_lock = threading.Lock()
+
+    def _iter_results(  # pylint: disable=too-many-arguments
+        self, function: Callable[[str], str], urls: Iterable[str], *, ordered: bool, max_pending: Optional[int], url_type: str, result_type: str
+    ) -> Iterator[Tuple[str, Union[str, exc.RequestError]]]:
+        max_pending = max_pending or (config.MAX_PENDING_PER_WORKER * self._max_workers)
+        log.debug(
+            "Concurrently retrieving %s URLs %s using %s workers with up to %s pending.",
+            result_type,
+            "in order" if ordered else "in order of completion",
+            self._max_workers,
+            max_pending,
         )
-        log.debug("Initialized thread pool executor.")
+        pending: Dict[concurrent.futures.Future, str] = {}  # Insertion ordered.
+        num_results, start_time = 0, time.monotonic()
+        try:
+            for url in urls:
+                if not isinstance(url, str):
+                    raise exc.ArgsError(f"{url_type.capitalize()} URLs must be URL strings, but one of them is {url!r}.")
+                pending[self._get_executor().submit(function, url)] = url
+                while len(pending) >= max_pending:
+                    futures = list(itertools.islice(pending, 1)) if ordered else concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED).done
+                    for future in futures:
+                        num_results += 1
+                        yield pending.pop(future), self._future_result(future)
+            futures = list(pending) if ordered else concurrent.futures.as_completed(pending)
+            for future in futures:
+                num_results += 1
+                yield pending.pop(future), self._future_result(future)
+        finally:
+            for future in pending:  # Remains nonempty only if the generator is closed early or if there is an error.
+                future.cancel()
+        time_used = time.monotonic() - start_time
+        rate_per_second = (num_results / time_used) if (time_used != 0) else float("inf")
+        log.info("Concurrently retrieved %s %s URLs in %.1fs at a rate of %s/s. %s", num_results, result_type, time_used, f"{rate_per_second:,.0f}", self._cache_state())
 
-    @staticmethod
-    def _is_known_short_url(url: str) -> bool:
-        result = urlparse(url)
-        return (result.netloc in config.KNOWN_SHORT_DOMAINS) and (result.scheme in {"https", "http"})
+    def _is_avoided(self, token: str) -> bool:
+        return self._scheduler.is_avoided(token) or (self._token_breaker.state(token) != "closed")
 
     def _lengthen_url(self, short_url: str) -> str:
         # Can raise: exc.RequestError
+        import requests  # pylint: disable=import-outside-toplevel
+
         short_url = short_url.strip()
+        long_url = self._lengthen_cache.get(short_url)
+        instrumentation = self._instrumentation
+        if instrumentation.enabled:
+            instrumentation.record_cache_lookup("lengthen", long_url is not None)
+        if long_url is not None:
+            return long_url
         log.debug("Requesting long URL for short URL %s.", short_url)
+        response = None
         try:
             start_time = time.monotonic()
-            response = self._thread_local.session_head.head(short_url, allow_redirects=False, timeout=config.REQUEST_TIMEOUT)
+            with instrumentation.span("lengthen") if instrumentation.enabled else contextlib.nullcontext():
+                response = self._sessions().session_head.head(short_url, allow_redirects=False, timeout=config.REQUEST_TIMEOUT)
             time_used = time.monotonic() - start_time
             response.raise_for_status()
         except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as exception:
+            if instrumentation.enabled:
+                instrumentation.record_lengthen_request(None if (response is None) else response.status_code)
             exc_desc = f"The error is: {exception.__class__.__qualname__}: {exception}"
             msg = f"Error receiving long URL for short URL {short_url}. {exc_desc}"
             raise exc.RequestError(msg) from None
-        assert response.status_code == 301
-        long_url = response.headers["Location"]
+        if instrumentation.enabled:
+            instrumentation.record_lengthen_request(response.status_code)
+        long_url = response.headers.get("Location")
+        if (response.status_code != 301) or (not long_url):
+            msg = f"Error receiving long URL for short URL {short_url}. The response status code is {response.status_code} instead of 301 with a location."
+            raise exc.RequestError(msg)
         log.debug(
             "Received long URL for short URL %s which is %s with status code %s in %.1fs.",
             short_url,
@@ -100,90 +278,342 @@ class Shortener:
             response.status_code,
             time_used,
         )
+        self._lengthen_cache.set(short_url, long_url)
         return long_url
 
-    def _shorten_url(self, long_url: str) -> str:  # pylint: disable=too-many-locals,method-hidden
+    def _lengthen_url_to_cache(self, short_url: str) -> str:
         # Can raise: exc.RequestError
+        long_url = self._lengthen_url(short_url)
+        if util.is_known_short_url(short_url):  # Any other redirect, such as from http to https, is not a short URL of the long URL.
+            self._cache.set(self._normalizer.normalize(long_url), util.postprocess_short_url(short_url))  # Reverse mapping for reshortening the long URL.
+        return long_url
 
-        # Preprocess long URL
-        long_url = long_url.strip()
-        if self._is_known_short_url(long_url):
-            # Note: A preexisting Bitly link can use one of many domains, not just bit.ly. It can also be
-            # a custom link or not. Such a link must be validated and normalized.
-            long_url = self._lengthen_url(long_url)
+    def _lookup_cached_urls(self, long_urls: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        # Returns the short URLs of the given normalized long URLs which are cached, and the long URLs which are not, in a single pass over the cache.
+        # The store, if any, is looked up for the long URLs which are not in the memory-cache.
+        cached_short_urls = self._cache.get_many(long_urls)
+        uncached_long_urls = [long_url for long_url in long_urls if long_url not in cached_short_urls] if cached_short_urls else long_urls
+        instrumentation = self._instrumentation
+        if instrumentation.enabled:
+            instrumentation.record_cache_lookup("shorten", True, num_lookups=len(cached_short_urls))
+            instrumentation.record_cache_lookup("shorten", False, num_lookups=len(uncached_long_urls))
+        store = self._store
+        if (store is not None) and uncached_long_urls:
+            stored_short_urls: Dict[str, str] = self._call_store(store.get_many, uncached_long_urls, default={})
+            if instrumentation.enabled:
+                instrumentation.record_cache_lookup("store", True, num_lookups=len(stored_short_urls))
+                instrumentation.record_cache_lookup("store", False, num_lookups=len(uncached_long_urls) - len(stored_short_urls))
+            if stored_short_urls:
+                self._cache.warm(stored_short_urls.items())
+                cached_short_urls.update(stored_short_urls)
+                uncached_long_urls = [long_url for long_url in uncached_long_urls if long_url not in stored_short_urls]
+        log.debug("Found %s of %s unique long URLs in cache or store, with %s to be requested.", len(cached_short_urls), len(long_urls), len(uncached_long_urls))
+        return cached_short_urls, uncached_long_urls
 
-        # Provision attempts
-        tokens = self._tokens
-        if len(tokens) > 1:
-            randomizer = random.Random(long_url)  # For reproducible randomization.
-            # Reproducibility of randomization is useful so as to prevent creating the same short URL under multiple
-            # tokens, as this counts toward a monthly creation quota.
-            tokens = randomizer.sample(tokens, len(tokens))  # Doesn't mutate original list.
-        endpoints = config.API_URL_BITLINKS, config.API_URL_SHORTEN  # Specified in reverse order due to pop().
-        attempts = [(endpoint, token) for endpoint in endpoints for token in tokens]
-        num_max_attempts = len(attempts)
+    def _normalize_long_urls(self, long_urls: List[str]) -> Tuple[List[str], List[str]]:
+        # Returns the normalized form of each long URL, and the unique normalized long URLs in order of first occurrence.
+        normalized_long_urls = self._normalizer.normalize_batch(long_urls)
+        unique_long_urls = list(dict.fromkeys(normalized_long_urls))
+        return normalized_long_urls, unique_long_urls
 
-        # Shorten long URL
-        while attempts:
-            endpoint, token = attempts.pop()
-            num_attempt = num_max_attempts - len(attempts)
-            endpoint_desc = f'endpoint /{endpoint.rpartition("/")[-1]}'
-            response_desc = f"response from {endpoint_desc} using token starting with " f"{token[:4]} for long URL {long_url} in attempt {num_attempt} of {num_max_attempts}"
+    def _post(self, endpoint: str, token: str, long_url: str, *, reserved: bool = False) -> "requests.Response":
+        # Can raise: requests.ConnectionError, requests.Timeout
+        if not reserved:
+            self._reserve(token)
+        instrumentation = self._instrumentation
+        with self._limiter, instrumentation.span("shorten", endpoint=endpoint, token=token[:4]) if instrumentation.enabled else contextlib.nullcontext():
+            start_time, status_code = time.monotonic(), None
             try:
-                log.debug("Requesting %s.", response_desc)
-                start_time = time.monotonic()
-                response = self._thread_local.session_post.post(
+                response = self._sessions().session_post.post(
                     url=endpoint,
-                    json={"long_url": long_url},
+                    data=util.json_dumps({"long_url": long_url}),
                     allow_redirects=False,
                     timeout=config.REQUEST_TIMEOUT,
-                    headers={"Authorization": f"Bearer {token}"},
+                    headers=self._headers[token],
                 )
+                status_code = response.status_code
+            finally:
                 time_used = time.monotonic() - start_time
-                response_json = response.json()
-                short_url_desc = f'with link {response_json["link"]}' if ("link" in response_json) else "without link"
-                log.debug(
-                    "Received %s having status code %s %s in %.1fs.",
-                    response_desc,
-                    response.status_code,
-                    short_url_desc,
-                    time_used,
-                )
-                response.raise_for_status()
+                self._latencies.record(endpoint, time_used)
+                success = (status_code is not None) and (status_code < 500)
+                self._endpoint_breaker.record(endpoint, success=success)
+                self._token_breaker.record(token, success=success)
+                if instrumentation.enabled:
+                    instrumentation.record_request(endpoint, token, status_code, time_used)
+        self._scheduler.record(token, response.status_code, util.parse_retry_after(response.headers.get("Retry-After")))
+        self._limiter.record(response.status_code)
+        self._quota.record(token, response.status_code)
+        return response
+
+    def _post_hedged(self, endpoint: str, token: str, long_url: str, attempts: List[Tuple[str, str]]) -> Tuple["requests.Response", str]:
+        # Can raise: requests.ConnectionError, requests.Timeout
+        # Returns the first successful response of the request and of its hedged request, if any, along with the token which was used for it.
+        if not self._hedge:
+            return self._post(endpoint, token, long_url), token
+        hedge_executor = self._get_executor("Hedger")
+        self._hedge_budget.record_request()
+        hedge_delay = self._latencies.hedge_delay(endpoint)
+        hedge_token = next((attempt_token for _, attempt_token in reversed(attempts) if (attempt_token != token) and not self._is_avoided(attempt_token)), None)
+        self._reserve(token)  # Prevents a wait for the token from counting toward the hedge delay.
+        futures = {hedge_executor.submit(self._post, endpoint, token, long_url, reserved=True): token}  # Insertion ordered.
+        if (hedge_delay is not None) and (hedge_token is not None):
+            done, _ = concurrent.futures.wait(futures, timeout=hedge_delay)
+            if (not done) and self._scheduler.is_ready(hedge_token) and self._hedge_budget.acquire():
+                log.debug("Hedging request for long URL %s with token starting with %s after %.2fs.", long_url, hedge_token[:4], hedge_delay)
+                futures[hedge_executor.submit(self._post, endpoint, hedge_token, long_url)] = hedge_token
+        pending = set(futures)
+        while True:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            succeeded = [future for future in done if (future.exception() is None) and future.result().ok]
+            if succeeded or not pending:
                 break
-            except (requests.HTTPError, requests.ConnectionError, requests.Timeout) as exception:
-                exc_desc = f"The error is: {exception.__class__.__qualname__}: {exception}"
-                if isinstance(exception, (requests.Timeout, requests.ConnectionError)):
-                    log.warning("Error receiving %s. %s", response_desc, exc_desc)
-                elif isinstance(exception, requests.HTTPError):
-                    if response.status_code == 400 and response_json["message"] == "ALREADY_A_BITLY_LINK":
-                        actual_long_url = self._lengthen_url(long_url)
-                        return self._shorten_url(actual_long_url)  # Returns normalized short URL.
-                    log.warning(
-                        "Error receiving %s. If this is due to token-specific rate limit, consider using more "
-                        "tokens, although an IP rate limit nevertheless applies. The response status code is "
-                        "%s and text is %s. %s",  # Still just a warning, and not an error yet.
-                        response_desc,
-                        response.status_code,
-                        response.text,
-                        exc_desc,
-                    )
-                    if response.status_code == 400:
-                        msg = f"The response status code is 400 and so the request will not be reattempted. {exc_desc}"
+        winner = succeeded[0] if succeeded else next(iter(futures))  # Is the original request if all failed.
+        for loser in futures:
+            if loser is not winner:
+                if succeeded and not loser.cancel():
+                    loser.add_done_callback(lambda future: self._hedge_budget.release(duplicate=(future.exception() is None) and (future.result().status_code == 201)))
+                else:
+                    self._hedge_budget.release(duplicate=False)
+        return winner.result(), futures[winner]
+
+    def _preprocess_long_url(self, long_url: str) -> Tuple[str, Optional[str]]:
+        # Can raise: exc.RequestError
+        # Returns the long URL to be shortened, and its short URL if it is a known short URL whose long URL is cached.
+        if not util.is_known_short_url(long_url):
+            return long_url, None
+        # Note: A preexisting Bitly link can use one of many domains, not just bit.ly. It can also be
+        # a custom link or not. Such a link must be validated and normalized.
+        long_url = self._lengthen_url(long_url)
+        short_url = self._cache.peek(self._normalizer.normalize(long_url))  # Is cached such as if the short URL was lengthened using lengthen_urls.
+        if short_url is not None:
+            log.debug("Returning cached short URL %s for lengthened long URL %s.", short_url, long_url)
+        return long_url, short_url
+
+    def _refresh_quota(self, *, concurrently: bool) -> None:
+        tokens = random.sample(self._tokens, len(self._tokens))
+        num_tokens = len(tokens)
+        if concurrently and (num_tokens > 1):
+            strategy_desc = "Concurrently"
+            num_workers = min(num_tokens, self._max_workers)
+            resource_desc = f" using {num_workers} workers"
+            mapper = self._get_executor().map
+        else:
+            strategy_desc = "Serially"
+            resource_desc = ""
+            mapper = map  # type: ignore
+        log.debug("%s retrieving usage for %s tokens%s.", strategy_desc, num_tokens, resource_desc)
+        start_time = time.monotonic()
+        usages = list(mapper(self._usage, tokens))
+        time_used = time.monotonic() - start_time
+        self._quota.update(dict(zip(tokens, usages)))
+        rate_per_second = (num_tokens / time_used) if (time_used != 0) else float("inf")
+        log.info(
+            "%s retrieved usage of %s for %s tokens%s in %.1fs at a rate of %s/s.",
+            strategy_desc,
+            f"{self._quota.usage():.1%}",
+            num_tokens,
+            resource_desc,
+            time_used,
+            f"{rate_per_second:,.0f}",
+        )
+
+    def _refresh_quota_in_background(self) -> None:
+        import requests  # pylint: disable=import-outside-toplevel
+
+        try:
+            self._refresh_quota(concurrently=False)
+        except (requests.RequestException, KeyError, ValueError) as exception:
+            log.warning("Error refreshing usage for quota tracking. The error is: %s: %s", exception.__class__.__qualname__, exception)
+        finally:
+            self._quota_refresh_lock.release()
+
+    def _request_short_url_via_store(self, long_url: str, store_batch: Optional[Dict[str, str]]) -> str:
+        # Can raise: exc.RequestError
+        # If a store batch is given, the long URL already missed the store, and its short URL is added to the batch so as to be stored together with the others,
+        # unless the store is single-flight, in which case the short URL must be stored before the lock is released.
+        store = cast(BaseStore, self._store)
+        short_url = self._call_store(store.get, long_url, default=None) if (store_batch is None) else None
+        if short_url is not None:
+            return short_url
+        while not self._call_store(store.lock, long_url, default=True):  # Another shortener sharing the store is requesting the long URL.
+            time.sleep(config.STORE_LOCK_POLL_INTERVAL)
+            short_url = self._call_store(store.get, long_url, default=None)
+            if short_url is not None:
+                log.debug("Received short URL %s for long URL %s from store after another shortener requested it.", short_url, long_url)
+                return short_url
+        try:
+            if store.single_flight:  # Another shortener could have stored it after the store was looked up.
+                short_url = self._call_store(store.get, long_url, default=None)
+            if short_url is None:
+                short_url = self._request_short_url(long_url)
+                if (store_batch is None) or store.single_flight:
+                    self._call_store(store.set, long_url, short_url, default=None)
+                else:
+                    store_batch[long_url] = short_url
+        finally:
+            self._call_store(store.unlock, long_url, default=None)
+        return short_url
+
+    def _reserve(self, token: str) -> None:
+        wait = self._scheduler.reserve(token)
+        if wait > 0:
+            log.debug("Waiting %.1fs before using token starting with %s.", wait, token[:4])
+            time.sleep(wait)
+
+    def _request_short_url(self, long_url: str) -> str:  # pylint: disable=too-many-locals
+        # Can raise: exc.RequestError
+        import requests  # pylint: disable=import-outside-toplevel
+
+        # Preprocess long URL
+        long_url, short_url = self._preprocess_long_url(long_url)
+        if short_url is not None:
+            return short_url
+
+        # Check quota
+        self._check_quota(long_url)
+
+        # Provision attempts
+        attempts = util.provision_attempts(self._tokens, long_url, self._latencies.order())
+        num_max_attempts = len(attempts)
+
+        # Shorten long URL
+        debug = log.isEnabledFor(logging.DEBUG)  # Descriptions are otherwise formatted only for errors.
+        instrumentation = self._instrumentation
+        num_attempt = 0
+        try:
+            for num_attempt, (endpoint, token) in enumerate(self._allowed_attempts(attempts, long_url), start=1):
+                try:
+                    if debug:
+                        log.debug("Requesting %s.", util.response_desc(endpoint, token, long_url, num_attempt, num_max_attempts))
+                    start_time = time.monotonic()
+                    response, token = self._post_hedged(endpoint, token, long_url, attempts) if (num_attempt == 1) else (self._post(endpoint, token, long_url), token)
+                    time_used = time.monotonic() - start_time
+                    if debug:
+                        log.debug(
+                            "Received %s having status code %s in %.1fs.",
+                            util.response_desc(endpoint, token, long_url, num_attempt, num_max_attempts),
+                            response.status_code,
+                            time_used,
+                        )
+                    response.raise_for_status()
+                    response_json = util.json_loads(response.content)  # Is parsed only if successful, as the body of an error, such as of a gateway, can be other than JSON.
+                    break
+                except (requests.HTTPError, requests.ConnectionError, requests.Timeout, ValueError) as exception:  # ValueError is of a body which isn't JSON.
+                    response_desc = util.response_desc(endpoint, token, long_url, num_attempt, num_max_attempts)
+                    exc_desc = f"The error is: {exception.__class__.__qualname__}: {exception}"
+                    if not isinstance(exception, requests.HTTPError):
+                        log.warning("Error receiving %s. %s", response_desc, exc_desc)
+                    else:
+                        if response.status_code == 400 and util.response_message(response.content) == "ALREADY_A_BITLY_LINK":
+                            actual_long_url = self._lengthen_url(long_url)
+                            return self._shorten_url(actual_long_url)  # Returns normalized short URL.
+                        log.warning(
+                            "Error receiving %s. If this is due to token-specific rate limit, consider using more "
+                            "tokens, although an IP rate limit nevertheless applies. The response status code is "
+                            "%s and text is %s. %s",  # Still just a warning, and not an error yet.
+                            response_desc,
+                            response.status_code,
+                            response.text,
+                            exc_desc,
+                        )
+                        if response.status_code == 400:
+                            msg = f"The response status code is 400 and so the request will not be reattempted. {exc_desc}"
+                            self._negative_cache.set(long_url, msg)
+                            raise exc.RequestError(msg) from None
+                    if num_attempt == num_max_attempts:
+                        msg = f"Exhausted all {num_max_attempts} attempts requesting response from {num_max_attempts} " f"for long URL {long_url}. {exc_desc}"
                         raise exc.RequestError(msg) from None
-                if not attempts:
-                    msg = f"Exhausted all {num_max_attempts} attempts requesting response from {num_max_attempts} " f"for long URL {long_url}. {exc_desc}"
-                    raise exc.RequestError(msg) from None
+        finally:
+            if instrumentation.enabled:
+                instrumentation.record_attempts(num_attempt)
         assert response.status_code in (200, 201)
-        short_url = response_json["link"]
+        self._thread_local.token = token  # pylint: disable=undefined-loop-variable
+        short_url = util.postprocess_short_url(response_json["link"])
+        log.debug("Returning short URL %s for long URL %s.", short_url, long_url)
+        return short_url
 
-        # Postprocess short URL
-        if short_url.startswith("http://"):  # Example: http://citi.us/2FPqsuZ
-            short_url = short_url.replace("http://", "https://", 1)
+    def _sessions(self) -> threading.local:
+        thread_local = self._thread_local
+        if not hasattr(thread_local, "session_post"):  # Sessions are created on first use in each thread.
+            self._init_requests_session()
+        return thread_local
 
-        log.debug("Returning short URL %s for long URL %s.", short_url, long_url)
+    def _shorten_normalized_url(self, long_url: str) -> str:
+        # Can raise: exc.RequestError
+        short_url = self._cache.get(long_url)
+        instrumentation = self._instrumentation
+        if instrumentation.enabled:
+            instrumentation.record_cache_lookup("shorten", short_url is not None)
+        if short_url is not None:
+            return short_url
+        return self._shorten_uncached_url(long_url)
+
+    def _shorten_url(self, long_url: str) -> str:
+        # Can raise: exc.RequestError
+        return self._shorten_normalized_url(self._normalizer.normalize(long_url))
+
+    def _shorten_uncached_url(self, long_url: str, store_batch: Optional[Dict[str, str]] = None) -> str:
+        # Can raise: exc.RequestError
+        # The long URL must be normalized and must have missed the cache. If a store batch is given, it must also have missed the store, as per
+        # _request_short_url_via_store.
+        instrumentation = self._instrumentation
+        executor = self._executors.get("Requester")  # Is not created for the serial path.
+        if instrumentation.enabled and (executor is not None):
+            instrumentation.record_queue_depth(executor._work_queue.qsize())  # pylint: disable=protected-access
+        error_msg = self._negative_cache.get(long_url)
+        if instrumentation.enabled:
+            instrumentation.record_cache_lookup("negative", error_msg is not None)
+        if error_msg is not None:
+            raise exc.RequestError(f"Not reattempting long URL {long_url} which previously failed. {error_msg}")
+
+        # Coalesce concurrent requests for the same long URL
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._inflight_lock:
+            inflight_future = self._inflight.setdefault(long_url, future)
+            if inflight_future is not future:
+                self._num_coalesced += 1
+        if inflight_future is not future:
+            log.debug("Waiting for in-flight request for long URL %s.", long_url)
+            return inflight_future.result()
+
+        try:
+            short_url = self._cache.peek(long_url)  # Another request for the long URL could have completed after the cache was looked up.
+            if short_url is None:
+                short_url = self._request_short_url_via_store(long_url, store_batch) if (self._store is not None) else self._request_short_url(long_url)
+                self._cache.set(long_url, short_url)  # Is set before the request is no longer in-flight.
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        else:
+            future.set_result(short_url)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[long_url]
         return short_url
 
+    def _shorten_uncached_url_result(self, long_url: str, store_batch: Optional[Dict[str, str]] = None) -> ShortenResult:
+        # The long URL must be normalized and must have missed the cache.
+        self._thread_local.token = None
+        start_time = time.monotonic()
+        try:
+            short_url, error = self._shorten_uncached_url(long_url, store_batch), None
+        except exc.RequestError as exception:
+            short_url, error = None, exception
+        time_used = time.monotonic() - start_time
+        return ShortenResult(long_url=long_url, short_url=short_url, error=error, time_used=time_used, token=self._thread_local.token)
+
+    def _start_quota_refresh(self) -> None:
+        if (time.monotonic() - self._quota_refresh_attempted) <= config.QUOTA_REFRESH_RETRY_TIME:
+            return
+        if self._quota_refresh_lock.acquire(blocking=False):  # pylint: disable=consider-using-with  # Released by the thread.
+            self._quota_refresh_attempted = time.monotonic()
+            threading.Thread(target=self._refresh_quota_in_background, name="QuotaRefresher", daemon=True).start()
+
+    def _store_batch(self, short_urls: Dict[str, str]) -> None:
+        if (self._store is not None) and short_urls:
+            self._call_store(self._store.set_many, short_urls, default=None)
+            log.debug("Stored %s short URLs in store.", len(short_urls))
+
     def _test(self) -> None:
         long_url = config.TEST_LONG_URL
         log.debug("Testing API for long URL %s.", long_url)
@@ -191,7 +621,7 @@ class Shortener:
         log.debug("Tested API for long URL %s. Received short URL %s.", long_url, short_url)
 
     def _usage(self, token: str) -> Dict[str, int]:
-        session = self._thread_local.session_get
+        session = self._sessions().session_get
         total_used, total_limit = 0, 0
         request_headers = {"Authorization": f"Bearer {token}"}
         response = session.get(config.API_URL_ORGANIZATIONS, headers=request_headers)
@@ -210,81 +640,198 @@ class Shortener:
                     break
         return {"used": total_used, "limit": total_limit}
 
+    def _wait_for_breakers(self, long_url: str, deadline: float) -> None:
+        # Can raise: exc.CircuitOpenError
+        while True:
+            wait = max(self._endpoint_breaker.wait_time(), self._token_breaker.wait_time())
+            if wait == 0:
+                return
+            if (time.monotonic() + wait) > deadline:
+                raise exc.CircuitOpenError(f"Not requesting short URL for long URL {long_url} as the circuit breakers of all endpoints or of all tokens are open for {wait:.1f}s.")
+            log.debug("Waiting up to %.1fs for a circuit breaker to allow a request for long URL %s.", wait, long_url)
+            time.sleep(min(wait, config.BREAKER_POLL_INTERVAL))  # A pending probe can close a breaker sooner.
+
+    @property
+    def breaker_states(self) -> Dict[str, Dict[str, str]]:
+        """Return the state of the circuit breaker of each endpoint and of each token, which is one of "closed", "open" and "half_open".
+
+        The endpoints are identified by the last component of their path, and the tokens by their first four characters.
+        """
+        return {"endpoints": self._endpoint_breaker.states(), "tokens": self._token_breaker.states()}
+
     @property
     def cache_info(self) -> Dict[str, _CacheInfo]:
         """Return cache info."""
-        source = self._shorten_url
-        return {source.__qualname__: source.cache_info()}  # type: ignore
+        stats = self._cache.stats()
+        return {self._shorten_url.__qualname__: _CacheInfo(stats.hits, stats.misses, stats.max_size, stats.size)}
+
+    @property
+    def cache_stats(self) -> Dict[str, CacheStats]:
+        """Return statistics of the caches of short URLs, of long URLs, and of long URLs which can't be shortened."""
+        return {"shorten": self._cache.stats(), "lengthen": self._lengthen_cache.stats(), "negative": self._negative_cache.stats()}
+
+    def lengthen_urls(self, short_urls: List[str]) -> List[str]:
+        """Return a list of long URLs for the given short URLs.
+
+        Each long URL of a short URL of a known Bitly domain is also cached as being shortened to its short URL, so that subsequently shortening it requires no request.
+        """
+        util.check_short_urls(short_urls)
+        num_short_urls = len(short_urls)
+        normalized_short_urls = self._short_url_normalizer.normalize_batch(short_urls)
+        unique_short_urls = list(dict.fromkeys(normalized_short_urls))
+        log.debug(
+            "Concurrently retrieving %s long URLs for %s unique short URLs using %s workers.",
+            num_short_urls,
+            len(unique_short_urls),
+            min(len(unique_short_urls), self._max_workers),
+        )
+        start_time = time.monotonic()
+        unique_long_urls = dict(zip(unique_short_urls, self._get_executor().map(self._lengthen_url_to_cache, unique_short_urls)))
+        long_urls = [unique_long_urls[short_url] for short_url in normalized_short_urls]
+        time_used = time.monotonic() - start_time
+        rate_per_second = (num_short_urls / time_used) if (time_used != 0) else float("inf")
+        log.info("Concurrently retrieved %s long URLs in %.1fs at a rate of %s/s. %s", num_short_urls, time_used, f"{rate_per_second:,.0f}", self._cache_state())
+        return long_urls
+
+    def lengthen_urls_iter(self, short_urls: Iterable[str], *, ordered: bool = True, max_pending: Optional[int] = None) -> Iterator[Tuple[str, Union[str, exc.RequestError]]]:
+        """Yield a tuple of each given short URL and its long URL, or the error which prevented lengthening it.
+
+        The short URLs are consumed lazily from the given iterable, which can therefore be unbounded.
+        Each long URL of a short URL of a known Bitly domain is also cached as being shortened to its short URL.
+
+        :param short_urls: iterable of short URLs.
+        :param ordered: if true, results are yielded in the order of the short URLs, otherwise in the order of completion.
+        :param max_pending: max number of short URLs which are being lengthened at a time. It defaults to twice the max number of workers.
+        """
+        return self._iter_results(self._lengthen_url_to_cache, short_urls, ordered=ordered, max_pending=max_pending, url_type="short", result_type="long")
 
-    @cachetools.func.ttl_cache(ttl=config.USAGE_CACHE_TIME)
     def usage(self) -> float:
         """Return the fraction of URL shortening quota used across the pool of tokens for the current calendar month.
 
-        The returned value is cached for an hour for the class instance.
+        The usage is retrieved for the tokens at most once an hour for the class instance, and is otherwise tracked locally.
         This is to attempt to prevent the usage tracking quota from being exceeded.
         """
-        tokens = random.sample(self._tokens, len(self._tokens))
-        num_tokens = len(tokens)
-        if (num_tokens > 1) or not hasattr(self._thread_local, "session_get"):  # 2nd check prevents bugs.
+        if self._quota.is_stale():
+            self._refresh_quota(concurrently=True)
+        return self._quota.usage()
+
+    def shorten_urls(self, long_urls: List[str]) -> List[str]:
+        """Return a list of short URLs for the given long URLs.
+
+        The cached long URLs are resolved in the calling thread, and only the uncached long URLs are submitted to the thread pool.
+        """
+        util.check_long_urls(long_urls)
+        num_long_urls = len(long_urls)
+        normalized_long_urls, unique_long_urls = self._normalize_long_urls(long_urls)
+        start_time = time.monotonic()
+        unique_short_urls, uncached_long_urls = self._lookup_cached_urls(unique_long_urls)
+        if len(uncached_long_urls) > 1:
             strategy_desc = "Concurrently"
-            num_workers = min(num_tokens, self._max_workers)
-            resource_desc = f" using {num_workers} workers"
-            mapper = self._executor.map
+            resource_desc = f" using {min(len(uncached_long_urls), self._max_workers)} workers"
+            mapper = self._get_executor().map
         else:
             strategy_desc = "Serially"
             resource_desc = ""
             mapper = map  # type: ignore
-        log.debug("%s retrieving usage for %s tokens%s.", strategy_desc, num_tokens, resource_desc)
-        start_time = time.monotonic()
-        usages = list(mapper(self._usage, tokens))
+        log.debug("%s retrieving %s short URLs for %s uncached unique long URLs%s.", strategy_desc, num_long_urls, len(uncached_long_urls), resource_desc)
+        store_batch: Dict[str, str] = {}  # Is stored at the end of the batch.
+        try:
+            unique_short_urls.update(zip(uncached_long_urls, mapper(functools.partial(self._shorten_uncached_url, store_batch=store_batch), uncached_long_urls)))
+        finally:
+            self._store_batch(store_batch)
+        short_urls = [unique_short_urls[long_url] for long_url in normalized_long_urls]
         time_used = time.monotonic() - start_time
-        usage = sum(u["used"] for u in usages) / sum(u["limit"] for u in usages)
-        rate_per_second = (num_tokens / time_used) if (time_used != 0) else float("inf")
+        assert num_long_urls == len(short_urls)
+        rate_per_second = (num_long_urls / time_used) if (time_used != 0) else float("inf")
         log.info(
-            "%s retrieved usage of %s for %s tokens%s in %.1fs at a rate of %s/s.",
+            "%s retrieved %s short URLs%s in %.1fs at a rate of %s/s with %s cache hits and %s misses of unique long URLs. %s",
             strategy_desc,
-            f"{usage:.1%}",
-            num_tokens,
+            num_long_urls,
             resource_desc,
             time_used,
             f"{rate_per_second:,.0f}",
+            len(unique_long_urls) - len(uncached_long_urls),
+            len(uncached_long_urls),
+            self._cache_state(),
         )
-        return usage
+        return short_urls
 
-    def shorten_urls(self, long_urls: List[str]) -> List[str]:
-        """Return a list of short URLs for the given long URLs."""
-        self._check_long_urls(long_urls)
+    def shorten_urls_batch(self, long_urls: List[str]) -> BatchResult:
+        """Return the result of shortening each of the given long URLs.
+
+        Unlike `shorten_urls`, an error in shortening a long URL does not prevent returning the short URLs of the other long URLs.
+        """
+        util.check_long_urls(long_urls)
         num_long_urls = len(long_urls)
-        if (len(set(long_urls)) > 1) or not hasattr(self._thread_local, "session_post"):  # 2nd check prevents bugs.
-            strategy_desc = "Concurrently"
-            num_workers = min(num_long_urls, self._max_workers)
-            resource_desc = f" using {num_workers} workers"
-            mapper = self._executor.map
-        else:
-            strategy_desc = "Serially"
-            resource_desc = ""
-            mapper = map  # type: ignore
-        log.debug("%s retrieving %s short URLs%s.", strategy_desc, num_long_urls, resource_desc)
+        normalized_long_urls, unique_long_urls = self._normalize_long_urls(long_urls)
         start_time = time.monotonic()
-        short_urls = list(mapper(self._shorten_url, long_urls))
-        time_used = time.monotonic() - start_time
-        num_short_urls = len(short_urls)
-        assert num_long_urls == num_short_urls
-        rate_per_second = (num_short_urls / time_used) if (time_used != 0) else float("inf")
+        cached_short_urls, uncached_long_urls = self._lookup_cached_urls(unique_long_urls)
+        num_uncached_long_urls = len(uncached_long_urls)
+        log.debug(
+            "Concurrently retrieving %s short URLs for %s uncached unique long URLs using %s workers.",
+            num_long_urls,
+            num_uncached_long_urls,
+            min(num_uncached_long_urls, self._max_workers),
+        )
+        unique_results = {long_url: ShortenResult(long_url=long_url, short_url=short_url, error=None, time_used=0.0) for long_url, short_url in cached_short_urls.items()}
+        mapper = self._get_executor().map if (num_uncached_long_urls > 1) else map
+        store_batch: Dict[str, str] = {}  # Is stored at the end of the batch.
+        try:
+            unique_results.update(zip(uncached_long_urls, mapper(functools.partial(self._shorten_uncached_url_result, store_batch=store_batch), uncached_long_urls)))
+        finally:
+            self._store_batch(store_batch)
+        results = fan_out_results(long_urls, normalized_long_urls, unique_results)
+        batch_result = BatchResult(results=results, time_used=time.monotonic() - start_time)
         log.info(
-            "%s retrieved %s short URLs%s in %.1fs at a rate of %s/s. %s",
-            strategy_desc,
-            num_short_urls,
-            resource_desc,
-            time_used,
-            f"{rate_per_second:,.0f}",
+            "Concurrently retrieved %s of %s short URLs in %.1fs with %s errors, and with %s cache hits and %s misses of unique long URLs. %s",
+            num_long_urls - len(batch_result.failed),
+            num_long_urls,
+            batch_result.time_used,
+            len(batch_result.failed),
+            len(cached_short_urls),
+            num_uncached_long_urls,
             self._cache_state(),
         )
-        return short_urls
+        return batch_result
+
+    def shorten_urls_iter(self, long_urls: Iterable[str], *, ordered: bool = True, max_pending: Optional[int] = None) -> Iterator[Tuple[str, Union[str, exc.RequestError]]]:
+        """Yield a tuple of each given long URL and its short URL, or the error which prevented shortening it.
+
+        The long URLs are consumed lazily from the given iterable, which can therefore be unbounded.
+
+        :param long_urls: iterable of long URLs.
+        :param ordered: if true, results are yielded in the order of the long URLs, otherwise in the order of completion.
+        :param max_pending: max number of long URLs which are being shortened at a time. It defaults to twice the max number of workers.
+        """
+        return self._iter_results(self._shorten_url, long_urls, ordered=ordered, max_pending=max_pending, url_type="long", result_type="short")
+
+    def shorten_urls_job(self, long_urls: Iterable[str], journal: Journal, *, max_pending: Optional[int] = None) -> Iterator[Tuple[str, Union[str, exc.RequestError]]]:
+        """Yield a tuple of each given long URL and its short URL, or the error which prevented shortening it, resuming from the given journal.
+
+        This is as per `shorten_urls_iter` with results in order, except that each shortened long URL is recorded in the journal, and that a long URL which is
+        already in the journal is not requested again. If the job is interrupted, such as by a crash, it can therefore be resumed by rerunning it with the same journal.
+
+        :param long_urls: iterable of long URLs.
+        :param journal: journal of the job.
+        :param max_pending: max number of long URLs which are being shortened at a time. It defaults to twice the max number of workers.
+        """
+        journaled_short_urls = journal.load()  # Keyed by normalized long URL.
+        log.info("Resuming job from %s with %s journaled short URLs.", journal, len(journaled_short_urls))
+
+        def shorten_url(long_url: str) -> str:
+            # Can raise: exc.RequestError
+            long_url = self._normalizer.normalize(long_url)
+            short_url = journaled_short_urls.get(long_url)
+            if short_url is None:
+                short_url = self._shorten_normalized_url(long_url)
+                journal.append(long_url, short_url)
+            return short_url
+
+        return self._iter_results(shorten_url, long_urls, ordered=True, max_pending=max_pending, url_type="long", result_type="short")
 
     def shorten_urls_to_dict(self, long_urls: List[str]) -> Dict[str, str]:
         """Return a mapping of short URLs for the given long URLs."""
-        self._check_long_urls(long_urls)
+        util.check_long_urls(long_urls)
         short_urls = self.shorten_urls(long_urls)
         url_map = dict(zip(long_urls, short_urls))
         return url_map
@@ -0,0 +1,344 @@
+"""Persistent stores of long URL to short URL mappings."""
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, List, Optional, Tuple, Type, Union
+from urllib.parse import parse_qs, urlparse
+
+from . import config, exc
+
+log = logging.getLogger(__name__)
+
+_REDIS_UNLOCK_SCRIPT = 'if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) else return 0 end'  # Deletes a lock only if it is owned.
+
+
+class BaseStore:
+    """Base class of thread-safe stores of long URL to short URL mappings.
+
+    A store is a second-level cache behind the memory-cache of a shortener, and it can be shared by many shorteners. Reads and writes are made in batches of up
+    to `config.STORE_MAX_BATCH_SIZE` long URLs.
+
+    If `single_flight` is true, a shortener which is to request the short URL of a long URL first locks the long URL in the store. Other shorteners sharing the store
+    then wait for the short URL to be stored instead of also requesting it. A lock expires after `config.STORE_LOCK_TTL` seconds if it is not released, such as if
+    its shortener crashed.
+
+    The exceptions which a store can raise when it is unavailable are listed in `errors`. A shortener then bypasses the store, using only its memory-cache.
+
+    :param single_flight: whether shorteners sharing the store lock each long URL in it while requesting it.
+    """
+
+    errors: Tuple[Type[Exception], ...] = (OSError, exc.StoreError)
+
+    def __init__(self, *, single_flight: bool = False):
+        self._single_flight = single_flight
+        self._owner_prefix = uuid.uuid4().hex  # Identifies the locks of this instance.
+
+    def _get_many(self, long_urls: List[str]) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def _lock(self, long_url: str, owner: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def _owner(self) -> str:
+        return f"{self._owner_prefix}:{threading.get_ident()}"  # A thread requests a long URL at most once at a time.
+
+    def _set_many(self, url_pairs: List[Tuple[str, str]]) -> None:
+        raise NotImplementedError
+
+    def _unlock(self, long_url: str, owner: str) -> None:
+        raise NotImplementedError
+
+    def get(self, long_url: str) -> Optional[str]:
+        """Return the short URL for the given long URL if it is stored, otherwise None."""
+        return self._get_many([long_url]).get(long_url)
+
+    def get_many(self, long_urls: Iterable[str]) -> Dict[str, str]:
+        """Return the short URLs of those of the given long URLs which are stored."""
+        long_urls = list(long_urls)
+        short_urls: Dict[str, str] = {}
+        for start in range(0, len(long_urls), config.STORE_MAX_BATCH_SIZE):
+            short_urls.update(self._get_many(long_urls[start : start + config.STORE_MAX_BATCH_SIZE]))
+        return short_urls
+
+    def lock(self, long_url: str) -> bool:
+        """Return whether the lock of the given long URL was acquired, which it always is if the store is not single-flight.
+
+        An acquired lock must be released using `unlock`.
+        """
+        return (not self._single_flight) or self._lock(long_url, self._owner(), config.STORE_LOCK_TTL)
+
+    def recent(self, limit: int) -> List[Tuple[str, str]]:  # pylint: disable=unused-argument
+        """Return up to the given number of most recently stored (long URL, short URL) pairs, oldest first.
+
+        It is empty if the store doesn't track recency.
+        """
+        return []
+
+    def set(self, long_url: str, short_url: str) -> None:
+        """Store the short URL for the given long URL."""
+        self._set_many([(long_url, short_url)])
+
+    def set_many(self, short_urls: Dict[str, str]) -> None:
+        """Store the given short URLs, which are keyed by long URL."""
+        url_pairs = list(short_urls.items())
+        for start in range(0, len(url_pairs), config.STORE_MAX_BATCH_SIZE):
+            self._set_many(url_pairs[start : start + config.STORE_MAX_BATCH_SIZE])
+
+    @property
+    def single_flight(self) -> bool:
+        """Return whether shorteners sharing the store lock each long URL in it while requesting it."""
+        return self._single_flight
+
+    def unlock(self, long_url: str) -> None:
+        """Release the lock of the given long URL, if it is still owned."""
+        if self._single_flight:
+            self._unlock(long_url, self._owner())
+
+
+class MemoryStore(BaseStore):
+    """In-process store of long URL to short URL mappings, which is shared only by the shorteners given the same instance.
+
+    It is a stand-in for a shared store, such as for tests.
+
+    :param single_flight: whether shorteners sharing the store lock each long URL in it while requesting it.
+    """
+
+    def __init__(self, *, single_flight: bool = False):
+        super().__init__(single_flight=single_flight)
+        self._urls: Dict[str, str] = {}  # In order of being stored.
+        self._locks: Dict[str, Tuple[str, float]] = {}  # Owner and monotonic expiration time of each lock.
+        self._mutex = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._urls)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(size={len(self)}, single_flight={self._single_flight})"
+
+    def _get_many(self, long_urls: List[str]) -> Dict[str, str]:
+        with self._mutex:
+            return {long_url: self._urls[long_url] for long_url in long_urls if long_url in self._urls}
+
+    def _lock(self, long_url: str, owner: str, ttl: float) -> bool:
+        now = time.monotonic()
+        with self._mutex:
+            if self._locks.get(long_url, ("", now))[1] > now:
+                return False
+            self._locks[long_url] = (owner, now + ttl)
+        return True
+
+    def _set_many(self, url_pairs: List[Tuple[str, str]]) -> None:
+        with self._mutex:
+            for long_url, short_url in url_pairs:
+                self._urls.pop(long_url, None)  # Moves it to the end.
+                self._urls[long_url] = short_url
+
+    def _unlock(self, long_url: str, owner: str) -> None:
+        with self._mutex:
+            if self._locks.get(long_url, ("", 0.0))[0] == owner:
+                del self._locks[long_url]
+
+    def recent(self, limit: int) -> List[Tuple[str, str]]:
+        """Return up to the given number of most recently stored (long URL, short URL) pairs, oldest first."""
+        with self._mutex:
+            return list(self._urls.items())[-limit:] if limit else []
+
+
+class RedisStore(BaseStore):
+    """Redis backed store of long URL to short URL mappings, which can be shared by shorteners across hosts.
+
+    The Redis protocol is spoken directly over a socket, and so no additional dependency is required. Other servers which implement the protocol can also be used.
+    Each long URL is stored as a key having the prefix `config.STORE_REDIS_KEY_PREFIX`, and its lock as a key having an additional "lock:" prefix.
+    As recency is not tracked, the memory-cache of a shortener is not warmed from the store.
+
+    :param url: URL of the server as redis://[[username]:password@]host[:port][/db], or as unix://path[?db=db] for a Unix socket.
+    :param single_flight: whether shorteners sharing the store lock each long URL in it while requesting it.
+    :param ttl: seconds after which a stored short URL expires, or None for no expiration.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", *, single_flight: bool = False, ttl: Optional[float] = None):
+        super().__init__(single_flight=single_flight)
+        parsed_url = urlparse(url)
+        if parsed_url.scheme not in ("redis", "unix"):
+            raise exc.ArgsError(f"Store URL must start with redis:// or unix://, but it is {url!r}.")
+        if parsed_url.scheme == "unix":
+            self._address: Union[str, Tuple[str, int]] = parsed_url.path
+            self._db = int(parse_qs(parsed_url.query).get("db", ["0"])[0])
+        else:
+            self._address = (parsed_url.hostname or "localhost", parsed_url.port or 6379)
+            self._db = int(parsed_url.path.strip("/") or 0)
+        self._credentials = [parsed_url.username, parsed_url.password] if parsed_url.username else [parsed_url.password]
+        self._ttl_ms = None if (ttl is None) else int(1000 * ttl)
+        self._desc = f"{parsed_url.scheme}://{parsed_url.hostname or ''}{'' if (parsed_url.port is None) else f':{parsed_url.port}'}{parsed_url.path}"  # Has no password.
+        self._thread_local = threading.local()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(url={self._desc!r}, single_flight={self._single_flight})"
+
+    @staticmethod
+    def _encode(command: Tuple[Any, ...]) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _connect(self) -> Tuple[socket.socket, IO[bytes]]:
+        # Can raise: OSError, exc.StoreError
+        if isinstance(self._address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(config.STORE_TIMEOUT)
+            sock.connect(self._address)
+        else:
+            sock = socket.create_connection(self._address, timeout=config.STORE_TIMEOUT)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = sock, sock.makefile("rb")
+        setup_commands: List[Tuple[Any, ...]] = []
+        if self._credentials[-1] is not None:
+            setup_commands.append(("AUTH", *self._credentials))
+        if self._db:
+            setup_commands.append(("SELECT", self._db))
+        if setup_commands:
+            self._send(connection, setup_commands)
+        log.debug("Connected to store %s.", self._desc)
+        return connection
+
+    def _execute(self, commands: List[Tuple[Any, ...]]) -> List[Any]:
+        # Can raise: OSError, exc.StoreError
+        # Sends the commands in a single pipeline and returns their replies, reconnecting once if the connection is stale.
+        connection = getattr(self._thread_local, "connection", None)  # A connection must not be shared across threads.
+        if connection is not None:
+            try:
+                return self._send(connection, commands)
+            except OSError as exception:
+                connection[0].close()
+                log.debug("Reconnecting to store %s after error: %s: %s", self._desc, exception.__class__.__qualname__, exception)
+        connection = self._thread_local.connection = self._connect()
+        try:
+            return self._send(connection, commands)
+        except OSError:
+            connection[0].close()
+            del self._thread_local.connection
+            raise
+
+    def _get_many(self, long_urls: List[str]) -> Dict[str, str]:
+        short_urls = self._execute([("MGET", *(config.STORE_REDIS_KEY_PREFIX + long_url for long_url in long_urls))])[0]
+        return {long_url: short_url for long_url, short_url in zip(long_urls, short_urls) if short_url is not None}
+
+    def _lock(self, long_url: str, owner: str, ttl: float) -> bool:
+        # The owner of the lock is compared instead of the reply of SET NX, which is not "OK" if the pipeline is resent after its replies were lost.
+        key = f"{config.STORE_REDIS_KEY_PREFIX}lock:{long_url}"
+        return self._execute([("SET", key, owner, "NX", "PX", int(1000 * ttl)), ("GET", key)])[1] == owner
+
+    @classmethod
+    def _read_reply(cls, file: IO[bytes]) -> Any:
+        # Can raise: OSError
+        # Returns an error reply as an exc.StoreError so that the replies of the other commands of a pipeline are nevertheless read.
+        line = file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection to Redis server was closed.")
+        prefix, value = line[:1], line[1:-2]
+        if prefix == b"+":
+            return value.decode()
+        if prefix == b"-":
+            return exc.StoreError(f"Redis server replied with error: {value.decode(errors='replace')}")
+        if prefix == b":":
+            return int(value)
+        if prefix == b"$":
+            return None if (int(value) < 0) else file.read(int(value) + 2)[:-2].decode()
+        if prefix == b"*":
+            return None if (int(value) < 0) else [cls._read_reply(file) for _ in range(int(value))]
+        raise ConnectionError(f"Redis server sent an unexpected reply: {line!r}")
+
+    def _send(self, connection: Tuple[socket.socket, IO[bytes]], commands: List[Tuple[Any, ...]]) -> List[Any]:
+        # Can raise: OSError, exc.StoreError
+        sock, file = connection
+        sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read_reply(file) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, exc.StoreError):
+                raise reply
+        return replies
+
+    def _set_many(self, url_pairs: List[Tuple[str, str]]) -> None:
+        if self._ttl_ms is None:
+            self._execute([("MSET", *(arg for long_url, short_url in url_pairs for arg in (config.STORE_REDIS_KEY_PREFIX + long_url, short_url)))])
+        else:
+            self._execute([("SET", config.STORE_REDIS_KEY_PREFIX + long_url, short_url, "PX", self._ttl_ms) for long_url, short_url in url_pairs])
+
+    def _unlock(self, long_url: str, owner: str) -> None:
+        self._execute([("EVAL", _REDIS_UNLOCK_SCRIPT, 1, f"{config.STORE_REDIS_KEY_PREFIX}lock:{long_url}", owner)])
+
+
+class SQLiteStore(BaseStore):
+    """SQLite backed persistent store of long URL to short URL mappings.
+
+    The store can concurrently be read and written by multiple threads and by multiple processes on the same host.
+    It is intended to be shared by a fleet of shorteners so as to prevent recreating the same short URL after a restart.
+
+    :param path: path of the database file. It is created if it doesn't exist.
+    :param single_flight: whether shorteners sharing the store lock each long URL in it while requesting it.
+    """
+
+    errors = BaseStore.errors + (sqlite3.Error,)
+
+    def __init__(self, path: Union[str, Path], *, single_flight: bool = False):
+        super().__init__(single_flight=single_flight)
+        self._path = Path(path)
+        self._thread_local = threading.local()
+        self._init_db()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__qualname__}(path={str(self._path)!r}, single_flight={self._single_flight})"
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._thread_local, "connection", None)
+        if connection is None:  # A connection must not be shared across threads.
+            connection = sqlite3.connect(str(self._path), timeout=config.STORE_TIMEOUT, isolation_level=None)
+            connection.execute(f"PRAGMA mmap_size={config.STORE_MMAP_SIZE}")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._thread_local.connection = connection
+            log.debug("Connected to store %s.", self._path)
+        return connection
+
+    def _get_many(self, long_urls: List[str]) -> Dict[str, str]:
+        placeholders = ", ".join("?" * len(long_urls))
+        return dict(self._connection().execute(f"SELECT long_url, short_url FROM urls WHERE long_url IN ({placeholders})", long_urls).fetchall())
+
+    def _init_db(self) -> None:
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")  # Allows readers to proceed concurrently with a writer.
+        connection.execute("CREATE TABLE IF NOT EXISTS urls (long_url TEXT PRIMARY KEY, short_url TEXT NOT NULL, updated REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS urls_updated ON urls (updated)")
+        connection.execute("CREATE TABLE IF NOT EXISTS locks (long_url TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+        log.debug("Initialized store %s.", self._path)
+
+    def _lock(self, long_url: str, owner: str, ttl: float) -> bool:
+        connection = self._connection()
+        now = time.time()  # Is comparable across processes, unlike monotonic time.
+        connection.execute("DELETE FROM locks WHERE long_url = ? AND expires < ?", (long_url, now))
+        return connection.execute("INSERT OR IGNORE INTO locks VALUES (?, ?, ?)", (long_url, owner, now + ttl)).rowcount == 1
+
+    def _set_many(self, url_pairs: List[Tuple[str, str]]) -> None:
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")  # Writes all rows in a single transaction.
+        try:
+            connection.executemany("INSERT OR REPLACE INTO urls VALUES (?, ?, ?)", ((long_url, short_url, now) for long_url, short_url in url_pairs))
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _unlock(self, long_url: str, owner: str) -> None:
+        self._connection().execute("DELETE FROM locks WHERE long_url = ? AND owner = ?", (long_url, owner))
+
+    def recent(self, limit: int) -> List[Tuple[str, str]]:
+        """Return up to the given number of most recently stored (long URL, short URL) pairs, oldest first."""
+        rows = self._connection().execute("SELECT long_url, short_url FROM urls ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        rows.reverse()
+        return rows
@@ -0,0 +1,107 @@
+"""Utilities shared by the shorteners."""
+import json
+import logging
+import random
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union, cast
+from urllib.parse import urlparse
+
+from . import config, exc
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional faster JSON library.
+    orjson = None  # type: ignore
+
+log = logging.getLogger(__name__)
+
+json_dumps: Callable[[Any], Union[bytes, str]] = orjson.dumps if orjson else json.dumps  # Returns bytes or an ASCII string, either of which is a request body.
+json_loads: Callable[[Union[bytes, str]], Any] = orjson.loads if orjson else json.loads
+
+
+def check_long_urls(long_urls: List[str]) -> None:
+    """Raise `exc.ArgsError` if the given long URLs are invalid."""
+    if not (isinstance(long_urls, list) and all(isinstance(long_url, str) for long_url in long_urls)):
+        raise exc.ArgsError("Long URLs must be a list of URL strings.")
+
+
+def check_short_urls(short_urls: List[str]) -> None:
+    """Raise `exc.ArgsError` if the given short URLs are invalid."""
+    if not (isinstance(short_urls, list) and all(isinstance(short_url, str) for short_url in short_urls)):
+        raise exc.ArgsError("Short URLs must be a list of URL strings.")
+
+
+def check_max_cache_size(max_cache_size: int) -> None:
+    """Raise `exc.ArgsError` if the given max cache size is invalid."""
+    max_cache_size = cast(Any, max_cache_size)
+    if (not isinstance(max_cache_size, int)) or (max_cache_size < 0):
+        raise exc.ArgsError(f"Max cache size must be an integer ≥0, but it is {max_cache_size}.")
+    log.debug("Max cache size is %s.", max_cache_size)
+
+
+def check_tokens(tokens: List[str]) -> None:
+    """Raise `exc.ArgsError` if the given tokens are invalid."""
+    if not (tokens and isinstance(tokens, list) and all(isinstance(token, str) for token in tokens) and (len(tokens) == len(set(tokens)))):
+        raise exc.ArgsError("Tokens must be a list of one or more unique strings.")  # Tokens must not be logged.
+    log.debug("Number of unique tokens is %s.", len(tokens))
+
+
+def is_known_short_url(url: str) -> bool:
+    """Return whether the given URL is a short URL of a known Bitly domain."""
+    result = urlparse(url)
+    return (result.netloc in config.KNOWN_SHORT_DOMAINS) and (result.scheme in {"https", "http"})
+
+
+def order_tokens(tokens: List[str], long_url: str) -> List[str]:
+    """Return the given sorted tokens in the order in which they are to be attempted for the given long URL.
+
+    Reproducibility of randomization is useful so as to prevent creating the same short URL under multiple tokens, as
+    this counts toward a monthly creation quota.
+    """
+    if len(tokens) == 1:
+        return tokens
+    randomizer = random.Random(long_url)  # For reproducible randomization.
+    return randomizer.sample(tokens, len(tokens))[::-1]  # Doesn't mutate original list. Is reversed as the attempts have always been made in the reverse order of the sample.
+
+
+def provision_attempts(tokens: List[str], long_url: str, endpoints: Optional[Sequence[str]] = None) -> List[Tuple[str, str]]:
+    """Return the (endpoint, token) attempts for the given long URL in the reverse order in which they are to be made.
+
+    The endpoints are given in order of preference, defaulting to /shorten followed by /bitlinks.
+    """
+    tokens = order_tokens(tokens, long_url)
+    endpoints = (config.API_URL_SHORTEN, config.API_URL_BITLINKS) if (endpoints is None) else endpoints
+    return [(endpoint, token) for endpoint in reversed(endpoints) for token in reversed(tokens)]  # In reverse order due to pop().
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the number of seconds in the given value of a Retry-After response header, if it is in seconds."""
+    try:
+        return float(value) if value else None
+    except ValueError:  # Value is an HTTP date.
+        return None
+
+
+def postprocess_short_url(short_url: str) -> str:
+    """Return the normalized form of the given short URL received from the API."""
+    if short_url.startswith("http://"):  # Example: http://citi.us/2FPqsuZ
+        short_url = short_url.replace("http://", "https://", 1)
+    return short_url
+
+
+def shard(tokens: List[str], long_url: str, num_shards: int) -> int:
+    """Return the index of the shard of the given long URL, which is that of the token attempted first for it among the given sorted tokens modulo the number of shards."""
+    return tokens.index(order_tokens(tokens, long_url)[0]) % num_shards
+
+
+def response_message(content: bytes) -> Optional[str]:
+    """Return the message of the given body of an error response of the API, or None if it isn't a JSON object having a message."""
+    try:
+        body = json_loads(content)
+    except ValueError:
+        return None
+    return body.get("message") if isinstance(body, dict) else None
+
+
+def response_desc(endpoint: str, token: str, long_url: str, num_attempt: int, num_max_attempts: int) -> str:
+    """Return a description of the response of a shortening request for use in log messages."""
+    return f'response from endpoint /{endpoint.rpartition("/")[-1]} using token starting with {token[:4]} for long URL {long_url} in attempt {num_attempt} of {num_max_attempts}'
@@ -0,0 +1,75 @@
+"""Benchmark the CPU time per long URL of the request path of the shortener, comparing it with that of the baseline request path, as for a cache miss.
+
+The baseline path provisions attempts using the static order of the endpoints, as it didn't order them by latency.
+"""
+import argparse
+import json
+import random
+import time
+import timeit
+from typing import Callable
+
+import requests
+
+from bitlyshortener import config, util  # pylint: disable=import-error
+from bitlyshortener.scheduler import LatencyTracker  # pylint: disable=import-error
+
+# pylint: disable=invalid-name
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--tokens", type=int, default=8, help="number of tokens")
+parser.add_argument("--urls", type=int, default=10_000, help="number of long URLs")
+args = parser.parse_args()
+
+tokens = sorted(f"{i:04d}{'0' * 36}" for i in range(args.tokens))
+long_urls = [f"https://example.com/path/{i}?query=value" for i in range(args.urls)]
+endpoints = (config.API_URL_SHORTEN, config.API_URL_BITLINKS)
+latencies = LatencyTracker(endpoints)
+for endpoint_latency in (0.02, 0.01) * config.MIN_LATENCY_SAMPLES:
+    latencies.record(endpoints[0], endpoint_latency)
+    latencies.record(endpoints[1], endpoint_latency)
+headers = {token: {"Authorization": f"Bearer {token}", "Content-Type": "application/json"} for token in tokens}
+response = requests.Response()
+response.status_code = 200
+response._content = json.dumps(  # pylint: disable=protected-access
+    {"created_at": "1970-01-01T00:00:00+0000", "id": "bit.ly/3IjSObD", "link": "https://bit.ly/3IjSObD", "long_url": long_urls[0], "archived": False, "tags": []}
+).encode()
+
+
+def baseline_attempts(long_url: str) -> None:
+    """Provision the attempts for the long URL as the baseline did, with a seeded sample of the tokens and the static order of the endpoints."""
+    ordered_tokens = random.Random(long_url).sample(tokens, len(tokens))
+    [(endpoint, token) for endpoint in reversed(endpoints) for token in ordered_tokens]  # pylint: disable=expression-not-assigned
+
+
+def current_attempts(long_url: str) -> None:
+    """Provision the attempts for the long URL as the shortener does."""
+    util.provision_attempts(tokens, long_url, latencies.order())
+
+
+def baseline_request(long_url: str) -> None:
+    """Prepare the request and parse the response as the baseline did."""
+    requests.Request("POST", endpoints[0], json={"long_url": long_url}, headers={"Authorization": f"Bearer {tokens[0]}"}).prepare()
+    response.json()["link"]  # pylint: disable=expression-not-assigned
+
+
+def current_request(long_url: str) -> None:
+    """Prepare the request and parse the response as the shortener does."""
+    requests.Request("POST", endpoints[0], data=util.json_dumps({"long_url": long_url}), headers=headers[tokens[0]]).prepare()
+    util.json_loads(response.content)["link"]  # pylint: disable=expression-not-assigned
+
+
+def microseconds_per_url(fn: Callable[[str], None]) -> float:
+    """Return the least CPU time in microseconds per long URL of the given function over a few repetitions."""
+
+    def run() -> None:
+        for long_url in long_urls:
+            fn(long_url)
+
+    return 1e6 * min(timeit.repeat(run, number=1, repeat=3, timer=time.process_time)) / args.urls
+
+
+print(f"JSON library is {'orjson' if util.orjson else 'json'}.")
+print(f"{'stage':>8} {'baseline_us':>11} {'current_us':>10} {'change_us':>9}")  # A positive change is a slowdown.
+for stage, baseline, current in (("attempts", baseline_attempts, current_attempts), ("request", baseline_request, current_request)):
+    baseline_us, current_us = microseconds_per_url(baseline), microseconds_per_url(current)
+    print(f"{stage:>8} {baseline_us:>11.1f} {current_us:>10.1f} {current_us - baseline_us:>+9.1f}")
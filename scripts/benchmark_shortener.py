@@ -0,0 +1,44 @@
+"""Benchmark the shortener using a local stand-in for the Bitly API."""
+import argparse
+import itertools
+import statistics
+import time
+
+from bitlyshortener import Cache, Shortener, config  # pylint: disable=import-error
+from bitlyshortener.fakeserver import FakeBitlyServer  # pylint: disable=import-error
+
+# pylint: disable=invalid-name
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--urls", type=int, default=1000, help="number of long URLs per run")
+parser.add_argument("--workers", type=int, nargs="+", default=[4, 16, 32], help="max numbers of worker threads")
+parser.add_argument("--tokens", type=int, nargs="+", default=[1, 4], help="numbers of tokens")
+parser.add_argument("--hit-ratios", type=float, nargs="+", default=[0.0, 0.9], help="fractions of long URLs which are cached beforehand")
+parser.add_argument("--latency", type=float, default=0.01, help="seconds of latency of the stand-in API")
+parser.add_argument("--latency-jitter", type=float, default=0.01, help="max seconds of random additional latency of the stand-in API")
+parser.add_argument("--rate-limit-error-rate", type=float, default=0.0, help="fraction of requests which receive a 429 error")
+parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction of requests which receive a 503 error")
+args = parser.parse_args()
+
+config.TOKEN_RATE_LIMIT = config.TOKEN_BURST_LIMIT = 10**9  # The stand-in has no rate limit other than that injected.
+
+print(f"{'workers':>7} {'tokens':>6} {'hit_ratio':>9} {'urls/s':>8} {'p50_ms':>7} {'p99_ms':>7} {'requests/url':>12} {'errors':>6}")
+for num_run, (max_workers, num_tokens, hit_ratio) in enumerate(itertools.product(args.workers, args.tokens, args.hit_ratios)):
+    config.MAX_WORKERS = config.MAX_WORKERS_PER_TOKEN = max_workers
+    long_urls = [f"https://example.com/{num_run}/{i}" for i in range(args.urls)]
+    num_cached = int(hit_ratio * args.urls)
+    with FakeBitlyServer(
+        latency=args.latency, latency_jitter=args.latency_jitter, rate_limit_error_rate=args.rate_limit_error_rate, server_error_rate=args.server_error_rate
+    ) as server:
+        cache = Cache(args.urls)
+        cache.warm((long_url, f"https://bit.ly/{i}") for i, long_url in enumerate(long_urls[:num_cached]))
+        shortener = Shortener(tokens=[f"token{i}" for i in range(num_tokens)], cache=cache)
+        start_time = time.monotonic()
+        batch_result = shortener.shorten_urls_batch(long_urls)
+        time_used = time.monotonic() - start_time
+        num_requests = server.requests["/v4/shorten"] + server.requests["/v4/bitlinks"]  # Excludes the requests of the background refresh of quota usage.
+    latencies_ms = sorted(1000 * result.time_used for result in batch_result.results)
+    p50_ms, p99_ms = statistics.median(latencies_ms), latencies_ms[int(0.99 * (len(latencies_ms) - 1))]
+    print(
+        f"{max_workers:>7} {num_tokens:>6} {hit_ratio:>9.0%} {args.urls / time_used:>8,.0f} {p50_ms:>7.1f} {p99_ms:>7.1f} "
+        f"{num_requests / args.urls:>12.2f} {len(batch_result.failed):>6}"
+    )
@@ -0,0 +1,41 @@
+"""Benchmark the import, construction, and first call latency of the shortener using a local stand-in for the Bitly API."""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from bitlyshortener import config  # pylint: disable=import-error
+from bitlyshortener.fakeserver import FakeBitlyServer  # pylint: disable=import-error
+
+_RUN_CODE = """
+import json, sys, time
+start_time = time.perf_counter()
+import bitlyshortener
+import_time = time.perf_counter()
+from bitlyshortener import Shortener, config
+config.API_URL_SHORTEN, config.API_URL_BITLINKS = sys.argv[1:3]
+shortener = Shortener(tokens=["token"], track_quota=False)
+init_time = time.perf_counter()
+shortener.shorten_urls([sys.argv[3]])
+call_time = time.perf_counter()
+shortener.shorten_urls([sys.argv[4]])
+second_call_time = time.perf_counter()
+print(json.dumps([import_time - start_time, init_time - import_time, call_time - init_time, second_call_time - call_time]))
+"""  # Each run is in a new process so that no module is already imported.
+
+# pylint: disable=invalid-name
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--runs", type=int, default=20, help="number of runs")
+args = parser.parse_args()
+
+timings = []
+with FakeBitlyServer() as server:
+    for num_run in range(args.runs):
+        long_urls = [f"https://example.com/{num_run}/0", f"https://example.com/{num_run}/1"]
+        output = subprocess.run([sys.executable, "-c", _RUN_CODE, config.API_URL_SHORTEN, config.API_URL_BITLINKS, *long_urls], capture_output=True, check=True, text=True).stdout
+        timings.append(json.loads(output))
+
+print(f"{'stage':>11} {'p50_ms':>7} {'max_ms':>7}")
+for stage, stage_timings in zip(("import", "init", "first_call", "second_call"), zip(*timings)):
+    print(f"{stage:>11} {1000 * statistics.median(stage_timings):>7.1f} {1000 * max(stage_timings):>7.1f}")
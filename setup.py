@@ -28,6 +28,13 @@ setup(
     url="https://github.com/impredicative/bitlyshortener/",
     packages=find_packages(exclude=["scripts"]),
     install_requires=parse_requirements("requirements/install.in"),
+    extras_require={
+        "async": parse_requirements("requirements/async.in"),
+        "opentelemetry": parse_requirements("requirements/opentelemetry.in"),
+        "orjson": parse_requirements("requirements/orjson.in"),
+        "prometheus": parse_requirements("requirements/prometheus.in"),
+    },
+    entry_points={"console_scripts": ["bitlyshortener = bitlyshortener.cli:main", "bitlyshortener-service = bitlyshortener.service:main"]},
     python_requires=">=3.7",
     classifiers=[  # https://pypi.org/classifiers/
         "Programming Language :: Python :: 3.7",
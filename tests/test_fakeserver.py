@@ -0,0 +1,82 @@
+"""Test the shorteners against the local stand-in for the Bitly API."""
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Iterator
+
+import pytest
+
+from bitlyshortener import AsyncShortener, BaseCache, Cache, CompactCache, Shortener, exc
+from bitlyshortener.fakeserver import FakeBitlyServer
+
+TOKENS = [f"{i:04d}{'0' * 36}" for i in range(3)]
+LONG_URL = "https://example.com/path?query=value"
+
+
+@pytest.fixture(name="fake")
+def fixture_fake() -> Iterator[FakeBitlyServer]:
+    """Yield a started fake server with `config` patched to use it."""
+    with FakeBitlyServer() as fake:
+        yield fake
+
+
+def test_async_shortener_lengthens_short_url(fake: FakeBitlyServer) -> None:
+    """Test that a short URL given to the asynchronous shortener is lengthened and then shortened."""
+    _status_code, body = fake.shorten(TOKENS[0], LONG_URL)
+
+    async def shorten() -> str:
+        async with AsyncShortener(tokens=TOKENS) as shortener:
+            return (await shortener.shorten_urls([body["link"]]))[0]
+
+    short_url = asyncio.run(shorten())
+    assert fake.requests["HEAD"] == 1
+    assert short_url.startswith(f"https://{fake.netloc}/")
+    assert fake.long_url(short_url.rpartition("/")[-1]) == LONG_URL
+
+
+@pytest.mark.usefixtures("fake")
+@pytest.mark.parametrize("cache", [Cache(100), CompactCache(100, digest_size=8)], ids=["Cache", "CompactCache"])
+def test_shortener_counts_each_cache_lookup_once(cache: BaseCache) -> None:
+    """Test that each long URL of a batch is counted once as a hit or a miss."""
+    long_urls = [f"https://example.com/{i}" for i in range(10)]
+    shortener = Shortener(tokens=TOKENS, cache=cache, track_quota=False)
+    shortener.shorten_urls(long_urls)
+    shortener.shorten_urls(long_urls[:5])
+    stats = shortener.cache_stats["shorten"]
+    assert (stats.hits, stats.misses) == (5, 10)
+
+
+class _OKHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        """Respond without a redirect."""
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format: str, *args: object) -> None:  # pylint: disable=redefined-builtin
+        """Don't log."""
+
+
+def test_shortener_reshortens_lengthened_short_url(fake: FakeBitlyServer) -> None:
+    """Test that shortening a short URL after lengthening it requires no request to shorten."""
+    short_url = Shortener(tokens=TOKENS, track_quota=False).shorten_urls([LONG_URL])[0]
+    short_url = short_url.replace("https://", "http://", 1)  # The fake server doesn't use TLS.
+    shortener = Shortener(tokens=TOKENS, track_quota=False)
+    assert shortener.lengthen_urls([short_url]) == [LONG_URL]
+    assert shortener.shorten_urls([LONG_URL, short_url]) == [short_url.replace("http://", "https://", 1)] * 2
+    assert fake.requests["/v4/shorten"] + fake.requests["/v4/bitlinks"] == 1
+
+
+@pytest.mark.usefixtures("fake")
+def test_shortener_lengthen_urls_iter_yields_error_for_non_redirect() -> None:
+    """Test that a URL which doesn't redirect yields an error without ending the stream, and isn't cached as a short URL."""
+    server = HTTPServer(("127.0.0.1", 0), _OKHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        short_url = Shortener(tokens=TOKENS, track_quota=False).shorten_urls([LONG_URL])[0].replace("https://", "http://", 1)
+        ok_url = f"http://127.0.0.1:{server.server_port}/page"
+        results = list(Shortener(tokens=TOKENS, track_quota=False).lengthen_urls_iter([ok_url, short_url]))
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert isinstance(results[0][1], exc.RequestError)
+    assert results[1] == (short_url, LONG_URL)
@@ -0,0 +1,15 @@
+"""Test the utilities shared by the shorteners."""
+from bitlyshortener import util
+from bitlyshortener.scheduler import TokenScheduler
+
+TOKENS = [f"{i:04d}{'0' * 36}" for i in range(5)]
+
+
+def test_shard_is_that_of_first_attempted_token() -> None:
+    """Test that a long URL is sharded by the token of its first scheduled attempt."""
+    scheduler = TokenScheduler(TOKENS)
+    for i in range(200):
+        long_url = f"https://example.com/{i}"
+        _endpoint, token = next(scheduler.schedule(util.provision_attempts(TOKENS, long_url)))
+        assert util.shard(TOKENS, long_url, len(TOKENS)) == TOKENS.index(token)
+        assert util.order_tokens(TOKENS, long_url)[0] == token